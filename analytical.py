@@ -1,10 +1,23 @@
+import math
+from collections import OrderedDict
 import numpy as np
-from numpy.linalg import matrix_power
-from scipy.linalg import expm
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+from scipy.special import gammaln, logsumexp
 from scipy.stats import poisson
 
-def mm1_markov_chain(lamda, mu, capacity= 1000):
+# gerador esparso (CSR) de uma cadeia de nascimento e morte com estados 0, ..., len(births)
+# births[n] é a taxa de n -> n+1 e deaths[n] a taxa de n+1 -> n
+def birth_death_generator(births, deaths):
+    births = np.asarray(births, dtype = np.float64)
+    deaths = np.asarray(deaths, dtype = np.float64)
+    diagonal = -(np.append(births, 0.0) + np.append(0.0, deaths))
+    return sparse.diags([deaths, diagonal, births], [-1, 0, 1], format = 'csr')
+
+def mm1_markov_chain(lamda, mu, capacity= 1000, as_sparse = False):
     N = capacity
+    if(as_sparse):
+        return birth_death_generator(np.full(N - 1, lamda), np.full(N - 1, mu))
     M = np.zeros(shape = (N,N))
     M[0,1] = lamda
     M[0,0] = - lamda
@@ -16,8 +29,13 @@ def mm1_markov_chain(lamda, mu, capacity= 1000):
         M[i, i -1] = mu
     return M
 
-def mmk_markov_chain(lamda, mu, k, capacity = 1000):
+def mmk_markov_chain(lamda, mu, k, capacity = 1000, as_sparse = False):
     N = capacity
+    if(as_sparse):
+        #como na matriz densa, o último estado sempre sai com taxa k * mu
+        deaths = np.minimum(np.arange(1, N), k) * mu
+        deaths[-1:] = k * mu
+        return birth_death_generator(np.full(N - 1, lamda), deaths)
     M = np.zeros(shape = (N,N))
     M[0,1] = lamda
     M[0,0] = - lamda
@@ -30,45 +48,350 @@ def mmk_markov_chain(lamda, mu, k, capacity = 1000):
         M[i, i -1] = _mu
     return M
 
+# matriz de transição da cadeia embutida da M/D/1 nas partidas: do estado i vai para
+# max(i - 1, 0) + (chegadas durante um serviço), que são Poisson(rho); a pmf é calculada uma vez
+# e disposta em diagonais (Toeplitz), e a última coluna absorve a cauda
 def md1_markov_chain(lamda, mu, capacity = 1000):
     rho = lamda/mu
-    def alpha(k, rho):
-        return poisson.pmf(k, rho)
-    M = np.zeros(shape = (capacity,capacity))
-    for i in range(capacity):
-        lower = max(0,i - 1)
-        for j in range(lower, capacity):
-            M[i,j] = alpha(j - lower, rho)
-
-    
+    alpha = poisson.pmf(np.arange(capacity), rho)
+    rows = np.arange(capacity)[:, None]
+    offset = np.arange(capacity)[None, :] - np.maximum(rows - 1, 0)
+    M = np.where(offset >= 0, alpha[np.clip(offset, 0, None)], 0.0)
+
     M[:, -1] = 1 - M.sum(axis = 1) + M[:, -1]
     return M
 
+# distribuição estacionária da cadeia embutida de uma fila M/G/1 (matriz de Hessenberg superior)
+# truncada em capacity estados, dada a cauda tail[k] = P(k ou mais chegadas durante um serviço)
+# igualando o fluxo através do corte entre os estados j-1 e j (fórmula de Ramaswami):
+#   pi_j * (1 - tail[1]) = pi_0 * tail[j] + sum_{i=1}^{j-1} pi_i * tail[j-i+1]
+# todos os termos são positivos, então a recursão é estável; O(capacity^2) em produtos internos
+def mg1_stationary_distribution(tail, capacity = 1000):
+    tail = np.asarray(tail, dtype = np.float64)
+    pi = np.zeros(capacity)
+    pi[0] = 1.0
+    a0 = 1 - tail[1]
+    for j in range(1, capacity):
+        pi[j] = (pi[0] * tail[j] + np.dot(pi[1:j], tail[j:1:-1])) / a0
+        #reescala para não estourar quando a cadeia cresce (rho >= 1)
+        if(pi[j] > 1e200):
+            pi[:j + 1] /= pi[j]
+    return pi / pi.sum()
+
+# distribuição estacionária da cadeia de md1_markov_chain, sem montar a matriz
+def md1_stationary_distribution(lamda, mu, capacity = 1000):
+    rho = lamda/mu
+    #poisson.sf(k - 1) = P(X >= k), calculada diretamente para não perder precisão na cauda
+    tail = poisson.sf(np.arange(capacity + 1) - 1, rho)
+    return mg1_stationary_distribution(tail, capacity)
+
+# distribuição estacionária de uma cadeia de nascimento e morte com estados 0, ..., len(births)
+# births[n] é a taxa de n -> n+1 e deaths[n] a taxa de n+1 -> n; pela forma produto,
+# pi_n é proporcional a prod_{i<n} births[i]/deaths[i], calculado em escala log e normalizado. O(N)
+def birth_death_stationary_distribution(births, deaths):
+    log_pi = np.concatenate(([0.0], np.cumsum(np.log(births) - np.log(deaths))))
+    pi = np.exp(log_pi - log_pi.max())
+    return pi / pi.sum()
+
+# distribuição estacionária da cadeia de mm1_markov_chain, sem montar a matriz
+def mm1_stationary_distribution(lamda, mu, capacity = 1000):
+    return birth_death_stationary_distribution(np.full(capacity - 1, lamda), np.full(capacity - 1, mu))
+
+# distribuição estacionária da cadeia de mmk_markov_chain, sem montar a matriz
+def mmk_stationary_distribution(lamda, mu, k, capacity = 1000):
+    deaths = np.minimum(np.arange(1, capacity), k) * mu
+    return birth_death_stationary_distribution(np.full(capacity - 1, lamda), deaths)
+
+# distribuição estacionária de um gerador Q qualquer (denso ou esparso): resolve pi Q = 0
+# com a última equação trocada pela normalização sum(pi) = 1, em um sistema esparso
 def ctmc_stationary_distribution(Q):
-    # if 'capacity' in kwargs:
-    #     Q = mm1_markov_chain(lamda, mu, capacity = kwargs['capacity'])
-    # else:
-    #     Q = mm1_markov_chain(lamda, mu)
-    pi = expm(Q* 100000)
-
-    if( np.isclose(pi, pi[0]).all() ):
-        return pi[0]
-    else:
-        return None 
+    A = sparse.lil_matrix(sparse.csr_matrix(Q).T)
+    A[-1, :] = 1
+    b = np.zeros(A.shape[0])
+    b[-1] = 1
+    pi = spsolve(A.tocsc(), b)
+    return pi
 
+# distribuição estacionária de uma matriz de transição P qualquer: pi P = pi é o mesmo sistema
+# que pi (P - I) = 0, resolvido como o de um gerador
 def dtmc_stationary_distribution(P):
-    # if 'capacity' in kwargs:
-    #     P = md1_markov_chain(lamda, mu, capacity = kwargs['capacity'])
-    # else:
-    #     P = md1_markov_chain(lamda, mu)
-    pi = matrix_power(P, 10000)
-    if( np.isclose(pi, pi[0]).all() ):
-        return pi[0]
+    P = sparse.csr_matrix(P)
+    return ctmc_stationary_distribution(P - sparse.identity(P.shape[0], format = 'csr'))
+
+#cache das distribuições estacionárias, compartilhado entre os objetos Simulation e os gráficos
+#chave: (modelo, lamda, mu, k, capacity); guarda no máximo STATIONARY_CACHE_SIZE vetores (LRU)
+STATIONARY_CACHE_SIZE = 64
+_stationary_cache = OrderedDict()
+
+_stationary_solvers = {
+    'mm1' : lambda lamda, mu, k, capacity: mm1_stationary_distribution(lamda, mu, capacity),
+    'mmk' : lambda lamda, mu, k, capacity: mmk_stationary_distribution(lamda, mu, k, capacity),
+    'md1' : lambda lamda, mu, k, capacity: md1_stationary_distribution(lamda, mu, capacity),
+}
+
+# distribuição estacionária memorizada do modelo 'mm1', 'mmk' ou 'md1' truncado em capacity estados
+# nessas cadeias o truncamento em capacity estados é o prefixo renormalizado de qualquer truncamento
+# maior, então um vetor mais longo já em cache também responde. o vetor retornado é somente leitura
+def stationary_distribution(model, lamda, mu, k = 1, capacity = 1000):
+    capacity = int(capacity)
+    key = (model, lamda, mu, k, capacity)
+    if(key in _stationary_cache):
+        _stationary_cache.move_to_end(key)
+        return _stationary_cache[key]
+
+    for cached_key, cached_pi in reversed(_stationary_cache.items()):
+        if(cached_key[:4] == key[:4] and cached_key[4] > capacity):
+            _stationary_cache.move_to_end(cached_key)
+            prefix = cached_pi[:capacity]
+            pi = prefix / prefix.sum()
+            pi.flags.writeable = False
+            return pi
+
+    pi = _stationary_solvers[model](lamda, mu, k, capacity)
+    pi.flags.writeable = False
+    _stationary_cache[key] = pi
+    if(len(_stationary_cache) > STATIONARY_CACHE_SIZE):
+        _stationary_cache.popitem(last = False)
+    return pi
+
+def clear_stationary_cache():
+    _stationary_cache.clear()
+
+# menor número de estados de uma M/M/k estável cuja cauda P(N >= capacity) fica abaixo de epsilon
+# pela forma produto, p_i ~ a^i/i! até k e, a partir de k, a cauda é geométrica de razão r = a/k:
+#   P(N >= n) = pi_k * r^(n-k) / (1 - r),  n >= k
+def _mmk_truncation_capacity(lamda, mu, k, epsilon):
+    a = lamda/mu
+    r = a/k
+    i = np.arange(k + 1)
+    log_p = i * np.log(a) - gammaln(i + 1)
+    log_tail_k = log_p[k] - np.log1p(-r)
+    log_total = logsumexp(np.append(log_p[:k], log_tail_k))
+    tail_k = np.exp(log_tail_k - log_total)
+    if(tail_k > epsilon):
+        n = k + int(np.ceil(np.log(epsilon/tail_k) / np.log(r)))
+        return n, tail_k * r**(n - k)
+    #a cauda já é pequena antes de k: P(N >= n) = sum_{n <= i < k} pi_i + P(N >= k)
+    tails = np.append(np.cumsum(np.exp(log_p[:k] - log_total)[::-1])[::-1] + tail_k, tail_k)
+    n = max(int(np.argmax(tails <= epsilon)), 1)
+    return n, tails[n]
+
+# menor número de estados da M/D/1 estável cuja cauda fica abaixo de epsilon
+# a recursão de mg1_stationary_distribution não depende da capacidade, e na cadeia infinita
+# pi_0 = 1 - rho; então a massa real dos primeiros n estados é (1 - rho) * cumsum(pi)[n-1] / pi[0]
+# para qualquer truncamento pi. dobra a capacidade até a cauda ficar abaixo de epsilon
+def _md1_truncation_capacity(lamda, mu, epsilon, max_capacity):
+    rho = lamda/mu
+    capacity = 64
+    while(True):
+        capacity = min(capacity, max_capacity)
+        pi = stationary_distribution('md1', lamda, mu, capacity = capacity)
+        tails = np.maximum(1 - (1 - rho) * np.cumsum(pi) / pi[0], 0)
+        if(tails[-1] <= epsilon or capacity == max_capacity):
+            n = int(np.argmax(tails <= epsilon)) + 1 if(tails[-1] <= epsilon) else capacity
+            return n, tails[n - 1]
+        capacity *= 2
+
+# número de estados (capacity) em que truncar a cadeia do modelo 'mm1', 'mmk' ou 'md1' para que a
+# massa descartada, P(N >= capacity), fique abaixo de epsilon; retorna (capacity, erro de truncamento)
+# limitado a max_capacity, caso em que o erro retornado pode passar de epsilon
+# cadeias instáveis (lamda >= k*mu) não têm distribuição estacionária: retorna (max_capacity, nan)
+def truncation_capacity(model, lamda, mu, k = 1, epsilon = 1e-9, max_capacity = 100000):
+    if(model != 'mmk'):
+        k = 1
+    if(lamda >= k * mu):
+        return max_capacity, math.nan
+    if(model == 'md1'):
+        capacity, error = _md1_truncation_capacity(lamda, mu, epsilon, max_capacity)
     else:
-        return None 
-        
+        capacity, error = _mmk_truncation_capacity(lamda, mu, k, epsilon)
+    if(capacity > max_capacity):
+        capacity = max_capacity
+        error = truncation_error(model, lamda, mu, k, capacity)
+    return capacity, float(error)
+
+# massa da distribuição estacionária descartada ao truncar a cadeia em capacity estados
+def truncation_error(model, lamda, mu, k = 1, capacity = 1000):
+    if(model != 'mmk'):
+        k = 1
+    if(lamda >= k * mu):
+        return math.nan
+    pi = stationary_distribution(model, lamda, mu, k, capacity = capacity)
+    if(model == 'md1'):
+        return float(max(1 - (1 - lamda/mu) / pi[0], 0))
+    #nascimento e morte: o truncamento é a distribuição condicionada a N < capacity, então
+    #1 - erro = P(N < capacity) = pi_0 real / pi_0 truncado
+    a = lamda/mu
+    i = np.arange(k)
+    log_p = i * np.log(a) - gammaln(i + 1)
+    log_pi0 = -logsumexp(np.append(log_p, k * np.log(a) - gammaln(k + 1) - np.log1p(-a/k)))
+    return float(max(1 - np.exp(log_pi0) / pi[0], 0))
+
+# distribuição estacionária truncada no menor número de estados em que a cauda descartada
+# fica abaixo de epsilon (ver truncation_capacity); retorna (pi, erro de truncamento)
+def truncated_stationary_distribution(model, lamda, mu, k = 1, epsilon = 1e-9, max_capacity = 100000):
+    capacity, error = truncation_capacity(model, lamda, mu, k, epsilon, max_capacity)
+    return stationary_distribution(model, lamda, mu, k, capacity = capacity), error
+
 def expected_value(pdf):
-    return sum( [i * pdf[i] for i in range(len(pdf)) ] )
+    return float(np.dot(np.arange(len(pdf)), pdf))
+
+# distribuição transiente p(t) = p0 exp(Q t) de um gerador Q (denso ou esparso) em todos os
+# instantes de t, por uniformização: com taxa uniforme r >= max |q_ii| e P = I + Q/r,
+#   p(t) = sum_n Poisson(n; r t) p0 P^n
+# os vetores p0 P^n são calculados uma única vez com produtos esparsos e combinados com os pesos
+# de Poisson de todos os instantes em blocos (um produto de matrizes por bloco). os termos são
+# truncados quando a massa de Poisson restante no maior instante fica abaixo de epsilon
+# retorna um array (len(t), estados)
+def uniformization(Q, t, p0, epsilon = 1e-10, block_size = 256):
+    Q = sparse.csr_matrix(Q)
+    t = np.atleast_1d(np.asarray(t, dtype = np.float64))
+    v = np.asarray(p0, dtype = np.float64)
+    rate = -Q.diagonal().min()
+    if(rate <= 0):
+        return np.tile(v, (len(t), 1))
+    #p0 P^(n+1) = P^T (p0 P^n)^T
+    PT = (sparse.identity(Q.shape[0], format = 'csr') + Q / rate).T.tocsr()
+    steps = int(poisson.isf(epsilon, rate * t.max())) + 1
+
+    result = np.zeros((len(t), len(v)))
+    for start in range(0, steps, block_size):
+        n = np.arange(start, min(start + block_size, steps))
+        V = np.empty((len(n), len(v)))
+        for j in range(len(n)):
+            V[j] = v
+            v = PT @ v
+        result += poisson.pmf(n[None, :], rate * t[:, None]) @ V
+    return result
+
+# distribuição transiente P(N(t) = n) da M/M/1 ('mm1') ou M/M/k ('mmk') que começa com
+# initial_state clientes, para todos os instantes de t; retorna um array (len(t), capacity)
+# sem capacity, trunca onde a cauda é desprezível: N(t) não passa de initial_state + chegadas em
+# [0, t], e partindo do vazio é estocasticamente menor que a distribuição estacionária
+def transient_distribution(model, lamda, mu, t, k = 1, initial_state = 0, capacity = None, epsilon = 1e-10):
+    if(model not in ['mm1', 'mmk']):
+        raise ValueError(f'modelo sem gerador markoviano: {model}')
+    if(model != 'mmk'):
+        k = 1
+    if(capacity is None):
+        capacity = initial_state + int(poisson.isf(epsilon, lamda * np.max(t))) + 2
+        if(initial_state == 0 and lamda < k * mu):
+            capacity = min(capacity, truncation_capacity(model, lamda, mu, k, epsilon)[0] + 1)
+    Q = mmk_markov_chain(lamda, mu, k, capacity = capacity, as_sparse = True)
+    p0 = np.zeros(capacity)
+    p0[initial_state] = 1
+    return uniformization(Q, t, p0, epsilon = epsilon)
+
+# probabilidade de bloqueio de Erlang B com carga a e k servidores, pela recursão
+# B_j = a B_{j-1} / (j + a B_{j-1}), que não estoura para k grande
+# a e k podem ser arrays (combinados por broadcasting): a recursão anda até max(k) de uma vez para
+# todas as configurações, e cada uma para de ser atualizada quando j passa do seu k
+def erlang_b(a, k):
+    a, k = np.broadcast_arrays(np.asarray(a, dtype = np.float64), np.asarray(k, dtype = np.int64))
+    B = np.ones(a.shape)
+    for j in range(1, int(k.max(initial = 0)) + 1):
+        B = np.where(j <= k, a * B / (j + a * B), B)
+    return B[()]
+
+# probabilidade de espera de Erlang C de uma M/M/k com carga a = lamda/mu, a partir de Erlang B
+# é 1 quando a fila é instável (a >= k); lamda, mu e k podem ser arrays
+def erlang_c(lamda, mu, k):
+    a = np.asarray(lamda, dtype = np.float64) / mu
+    B = erlang_b(a, k)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        C = B / (1 - (a/k) * (1 - B))
+    return np.where(a < k, C, 1.0)[()]
+
+# métricas da M/M/k em forma fechada (Erlang C), vetorizadas sobre arrays de lamda, mu e k
+# número médio de clientes na fila de espera: Lq = C * r / (1 - r), com r = a/k
+# infinito quando a fila é instável
+def mmk_average_queue(lamda, mu, k):
+    r = np.asarray(lamda, dtype = np.float64) / (np.asarray(mu) * k)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        Lq = erlang_c(lamda, mu, k) * r / (1 - r)
+    return np.where(r < 1, Lq, np.inf)[()]
+
+# número médio de clientes no sistema: L = Lq + a
+def mmk_average_customers(lamda, mu, k):
+    return (mmk_average_queue(lamda, mu, k) + np.asarray(lamda, dtype = np.float64) / mu)[()]
+
+# tempo médio de permanência pela lei de Little: W = L / lamda
+def mmk_average_wait(lamda, mu, k):
+    return (mmk_average_customers(lamda, mu, k) / np.asarray(lamda, dtype = np.float64))[()]
+
+# utilização de cada servidor, E[min(N, k)]/k = a/k, limitada a 1
+def mmk_utilization(lamda, mu, k):
+    return np.minimum(np.asarray(lamda, dtype = np.float64) / (np.asarray(mu) * k), 1.0)[()]
+
+# funções de distribuição do tempo de espera na fila (delay, antes do serviço) e do tempo de
+# permanência (sojourn, espera + serviço) em filas estáveis com disciplina FIFO
+# t pode ser um escalar ou um array de instantes; todos são avaliados de uma vez
+def mm1_delay_cdf(lamda, mu, t):
+    t = np.asarray(t, dtype = np.float64)
+    return np.where(t < 0, 0.0, 1 - (lamda/mu) * np.exp(-(mu - lamda) * t))
+
+def mm1_sojourn_cdf(lamda, mu, t):
+    t = np.asarray(t, dtype = np.float64)
+    return np.where(t < 0, 0.0, -np.expm1(-(mu - lamda) * np.maximum(t, 0)))
+
+# a espera de quem encontra os k servidores ocupados (probabilidade C) é exponencial de taxa k*mu - lamda
+def mmk_delay_cdf(lamda, mu, k, t):
+    t = np.asarray(t, dtype = np.float64)
+    C = erlang_c(lamda, mu, k)
+    return np.where(t < 0, 0.0, 1 - C * np.exp(-(k * mu - lamda) * t))
+
+# permanência = espera + serviço: com probabilidade 1 - C só o serviço, exponencial de taxa mu;
+# com probabilidade C a soma de exponenciais de taxas theta = k*mu - lamda e mu (hipoexponencial,
+# que vira uma Erlang-2 quando theta = mu, isto é, k - 1 - lamda/mu = 0)
+def mmk_sojourn_cdf(lamda, mu, k, t):
+    t = np.maximum(np.asarray(t, dtype = np.float64), 0)
+    C = erlang_c(lamda, mu, k)
+    theta = k * mu - lamda
+    if(math.isclose(theta, mu)):
+        both = (1 + mu * t) * np.exp(-mu * t)
+    else:
+        both = (theta * np.exp(-mu * t) - mu * np.exp(-theta * t)) / (theta - mu)
+    return np.where(t <= 0, 0.0, 1 - (1 - C) * np.exp(-mu * t) - C * both)
+
+# espera na fila de uma M/D/1, com o serviço D = 1/mu como unidade e t = (k + tau) D, 0 <= tau < 1
+# quem chega espera no máximo t se, dos clientes presentes na chegada, no máximo k ainda estão no
+# sistema tau*D depois. olhando uma unidade D para trás, esse número é (L - 1)^+ + A, com L o
+# número de clientes em t - D (distribuição estacionária) e A ~ Poisson(rho (1 - tau)) as chegadas
+# até a chegada observada, independentes de L:
+#   P(W <= t) = sum_{i <= k} P(A = i) * P((L - 1)^+ <= k - i)
+# ao contrário da fórmula de Crommelin, todos os termos são positivos, então é estável para t grande
+def md1_delay_cdf(lamda, mu, t, epsilon = 1e-12):
+    t = np.asarray(t, dtype = np.float64)
+    rho = lamda/mu
+    x = np.maximum(t, 0) * mu
+    k = np.floor(x).astype(np.int64)
+    tau = x - k
+
+    pi, _ = truncated_stationary_distribution('md1', lamda, mu, epsilon = epsilon)
+    #distribuição acumulada de (L - 1)^+, igual a 1 depois do truncamento
+    q = np.append(pi[0] + pi[1:2], pi[2:]) if len(pi) > 1 else np.ones(1)
+    Q = np.cumsum(q)
+    Q = np.append(Q / Q[-1], 1.0)
 
+    #P(A = i) é desprezível a partir de poucas dezenas de termos, já que a média é menor que 1
+    terms = int(poisson.isf(epsilon, rho)) + 2
+    i = np.arange(terms)
+    weights = poisson.pmf(i[None, :], rho * (1 - tau.reshape(-1, 1)))
+    rest = k.reshape(-1, 1) - i[None, :]
+    cdf = np.where(rest >= 0, weights * Q[np.clip(rest, 0, len(Q) - 1)], 0.0).sum(axis = 1)
+    return np.where(t < 0, 0.0, np.minimum(cdf, 1.0).reshape(t.shape))
 
+def md1_sojourn_cdf(lamda, mu, t, epsilon = 1e-12):
+    t = np.asarray(t, dtype = np.float64)
+    return md1_delay_cdf(lamda, mu, t - 1/mu, epsilon = epsilon) * (t >= 1/mu)
 
+# função de distribuição do tempo de permanência (sojourn = True) ou de espera do modelo
+# 'mm1', 'mmk' ou 'md1' nos instantes t
+def wait_time_cdf(model, lamda, mu, t, k = 1, sojourn = True):
+    if(model == 'mm1'):
+        return mm1_sojourn_cdf(lamda, mu, t) if sojourn else mm1_delay_cdf(lamda, mu, t)
+    if(model == 'mmk'):
+        return mmk_sojourn_cdf(lamda, mu, k, t) if sojourn else mmk_delay_cdf(lamda, mu, k, t)
+    if(model == 'md1'):
+        return md1_sojourn_cdf(lamda, mu, t) if sojourn else md1_delay_cdf(lamda, mu, t)
+    raise ValueError(f'modelo desconhecido: {model}')
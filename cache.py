@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+#cache em disco de resultados de simulação, endereçado pelo conteúdo dos parâmetros
+#cada entrada é um .npz (binário, colunar) com as colunas do ledger ou os acumuladores do modo
+#streaming, mais os metadados em JSON; a chave é o hash SHA-256 dos parâmetros, da versão dos
+#motores e da semente. quando o diretório passa de max_bytes, as entradas usadas há mais tempo
+#são removidas (LRU pelo mtime, que é atualizado a cada acerto)
+class SimulationCache:
+
+  def __init__(self, directory = '.simulation_cache', max_bytes = 2**30):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    os.makedirs(directory, exist_ok = True)
+
+  def key(self, **params) -> str:
+    text = json.dumps(params, sort_keys = True, default = str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, f'{key}.npz')
+
+  def __contains__(self, key):
+    return os.path.exists(self._path(key))
+
+  #retorna (arrays, metadados) ou None se a chave não estiver no cache
+  def load(self, key):
+    path = self._path(key)
+    try:
+      with np.load(path, allow_pickle = False) as entry:
+        arrays = {name : entry[name] for name in entry.files if name != '__meta__'}
+        meta = json.loads(str(entry['__meta__']))
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+      return None
+    os.utime(path)
+    return arrays, meta
+
+  def store(self, key, arrays, meta = None):
+    path = self._path(key)
+    #grava em um arquivo temporário e renomeia, para nunca deixar uma entrada pela metade
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+      np.savez(file, __meta__ = np.array(json.dumps(meta or {}, default = str)), **arrays)
+    os.replace(temporary, path)
+    self._evict()
+
+  def _entries(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      if(name.endswith('.npz')):
+        stat = os.stat(os.path.join(self.directory, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    return sorted(entries)
+
+  @property
+  def size(self):
+    return sum(size for _, size, _ in self._entries())
+
+  #remove as entradas menos usadas recentemente até o cache caber em max_bytes
+  def _evict(self):
+    entries = self._entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in entries:
+      if(total <= self.max_bytes):
+        break
+      os.remove(os.path.join(self.directory, name))
+      total -= size
+
+  #remove a entrada de uma chave, ou a dos parâmetros dados (todos os que formam a chave; para as
+  #simulações, a chave vem de simulations.queue_sim_key ou mmk.queue_sim_key)
+  def invalidate(self, key = None, **params):
+    if(key is None):
+      key = self.key(**params)
+    path = self._path(key)
+    if(os.path.exists(path)):
+      os.remove(path)
+      return True
+    return False
+
+  #remove todas as entradas
+  def clear(self):
+    for _, _, name in self._entries():
+      os.remove(os.path.join(self.directory, name))
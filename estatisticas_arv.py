@@ -0,0 +1,84 @@
+import simulations
+import numpy as np
+import pandas as pd
+from math import sqrt
+from estruturas_arv import Z, construirFloresta
+
+# Amostras numéricas dos subitens 2 a 7 do item 5.2, calculadas de uma vez sobre os arrays da floresta
+# (ver estruturas_arv.Floresta), em vez de percorrer cada árvore do treelib nó a nó
+# Cada grandeza sai de uma redução linear sobre os ponteiros de pai: o grau de saída é a contagem (bincount) dos pais,
+# e o máximo, a altura e o tamanho de cada árvore são reduções (reduceat) sobre os seus nós, que são contíguos
+# Como nas funções qNnumerica, árvores infinitas têm altura, tamanho e média das alturas dos nós infinitos
+# trace (Simulation.data) é opcional: sem ele não há amostras do subitem 6, que depende dos instantes dos eventos
+def amostrasDasArvores(floresta,trace=None,minimoParaInfinitude=300):
+	raizes = floresta.inicios[:-1]
+	infinita = floresta.infinita
+	filhos = floresta.pai[floresta.pai >= 0]
+	grau = np.bincount(filhos, minlength=len(floresta.pai)) # Grau de saída de cada nó
+
+	if len(floresta) > 0:
+		grauMaximo = np.maximum.reduceat(grau, raizes)
+		altura = np.maximum.reduceat(floresta.profundidade, raizes)
+	else:
+		grauMaximo = altura = np.zeros(0, dtype=np.int64)
+
+	# Alturas dos nós das árvores finitas, e um infinito por árvore infinita
+	noFinito = ~infinita[floresta.periodo]
+	alturasDosNos = np.append(floresta.profundidade[noFinito].astype(np.float64), np.full(infinita.sum(), np.inf))
+
+	amostras = {
+		'q2' : grau[raizes], # Grau de saída da raiz
+		'q3' : grauMaximo, # Grau de saída máximo
+		'q4' : np.where(infinita, np.inf, altura), # Altura da árvore
+		'q5' : alturasDosNos, # Altura de cada nó
+		'q7' : np.where(infinita, np.inf, floresta.tamanhos) # Número de clientes atendidos no período ocupado
+	}
+	if trace is not None:
+		amostras['q6'] = duracoesDosPeriodos(trace,minimoParaInfinitude)
+	return dict(sorted(amostras.items()))
+
+# Duração de cada período ocupado de um trace (amostras do subitem 6), em uma passada vetorizada
+# Um período começa em uma chegada com N == 1 e termina na partida com N == 0; como em q6numerica, o período
+# incompleto no fim de uma run conta como infinito se durou mais de minimoParaInfinitude passos, e é descartado caso contrário
+def duracoesDosPeriodos(trace,minimoParaInfinitude=300):
+	if not trace.run.is_monotonic_increasing:
+		trace = trace.sort_values('run', kind='stable')
+	run = trace.run.to_numpy()
+	tempo = trace.time.to_numpy()
+	N = trace.N.to_numpy()
+	chegada = (trace.type == 'a').to_numpy()
+
+	# Índice do começo do período mais recente em cada evento (o primeiro evento de cada run é um começo)
+	comeco = chegada & (N == 1)
+	ultimoComeco = np.maximum.accumulate(np.where(comeco, np.arange(len(N)), 0))
+	fins = np.flatnonzero(~chegada & (N == 0))
+	duracoes = tempo[fins] - tempo[ultimoComeco[fins]]
+
+	_, inicios, contagens = np.unique(run, return_index=True, return_counts=True)
+	ultimos = inicios + contagens - 1
+	infinitas = (N[ultimos] != 0) & (ultimos - ultimoComeco[ultimos] > minimoParaInfinitude)
+	return np.append(duracoes, np.full(infinitas.sum(), np.inf))
+
+# Média e intervalo de confiança de cada vetor de amostras, como nas funções qNnumerica
+def _intervalo(amostras):
+	amostras = pd.Series(amostras, dtype=np.float64)
+	media = amostras.mean()
+	s = amostras.std()
+	n = amostras.count()
+	if n>0:
+		intervalo = (media - Z*(s/sqrt(n)), media + Z*(s/sqrt(n)))
+	else:
+		intervalo = (0,0)
+	return media, intervalo, n
+
+# Tabela com média, intervalo de confiança e número de amostras de cada subitem (ver amostrasDasArvores)
+def estatisticasDasArvores(floresta,trace=None,minimoParaInfinitude=300):
+	amostras = amostrasDasArvores(floresta,trace,minimoParaInfinitude)
+	tabela = {questao : dict(zip(('Média', 'Intervalo de confiança', 'Amostras'), _intervalo(valores))) for questao, valores in amostras.items()}
+	return pd.DataFrame.from_dict(tabela, orient='index')
+
+# Simula as filas uma vez e calcula as estatísticas dos subitens 2 a 7 sobre o mesmo trace
+def estatisticasDaSimulacao(lamda,mu,kind,runs=300,max_time=3000,max_events=3000,minimoParaInfinitude=300):
+	trace = simulations.queue_sim(lamda,mu,max_time=max_time,max_events=max_events,runs=runs,kind=kind,export=False).data
+	floresta = construirFloresta(trace,minimoParaInfinitude)
+	return estatisticasDasArvores(floresta,trace,minimoParaInfinitude)
@@ -1,6 +1,6 @@
 import simulations
+import numpy as np
 import pandas as pd
-import queue
 from treelib import Tree,Node
 from math import pow,exp,factorial,sqrt
 import matplotlib.pyplot as plt
@@ -8,43 +8,108 @@ import matplotlib.pyplot as plt
 
 Z = 1.96 # Grau de confiança a ser usado em todas as questões
 
-# Cria árvores (processos de ramificação) baseado em um trace da simulação
-def gerarArvores(lamda,mu,kind,runs=300,max_time=3000,max_events=3000,minimoParaInfinitude=300):
+# Floresta de períodos ocupados (processos de ramificação) guardada em arrays, com um nó por cliente na ordem das chegadas
+# Cada período ocupado é uma árvore; seus nós são contíguos nos arrays, a partir da raiz
+#	run: run de cada nó
+#	passo: identificador do nó, a posição da chegada no trace da run (como em gerarArvores)
+#	pai: índice do nó pai nos arrays, -1 nas raízes
+#	periodo: índice do período ocupado (árvore) de cada nó
+#	profundidade: distância de cada nó até a raiz (a raiz tem profundidade 0)
+#	inicios: índice da raiz de cada árvore, seguido do número total de nós
+#	infinita: se cada árvore é infinita (incompleta no fim da run), o "inf" das árvores do treelib
+class Floresta:
+	def __init__(self,run,passo,pai,infinita):
+		self.run = run
+		self.passo = passo
+		self.pai = pai
+		self.inicios = np.append(np.flatnonzero(pai < 0), len(pai))
+		self.periodo = np.repeat(np.arange(len(self.inicios)-1), np.diff(self.inicios))
+		self.profundidade = _profundidades(pai)
+		self.infinita = infinita
+
+	def __len__(self): # Número de árvores
+		return len(self.inicios)-1
+
+	# Número de nós de cada árvore
+	@property
+	def tamanhos(self):
+		return np.diff(self.inicios)
+
+	# Adaptador: monta a árvore i como treelib.Tree, com os mesmos nós e dados de gerarArvores
+	def arvore(self,i):
+		arvore = Tree()
+		for no in range(self.inicios[i],self.inicios[i+1]):
+			passo = int(self.passo[no])
+			pai = None if self.pai[no] < 0 else int(self.passo[self.pai[no]])
+			arvore.create_node("Chegada no instante " + str(passo), passo, pai)
+		if self.infinita[i]:
+			arvore.get_node(arvore.root).data = "inf"
+		return arvore
+
+	def arvores(self):
+		return [self.arvore(i) for i in range(len(self))]
+
+# Profundidade de cada nó por saltos de ponteiros (pointer doubling): cada nó guarda um ancestral e a distância até ele,
+# e a cada passo salta para o ancestral do seu ancestral, somando as distâncias; termina em O(log(altura)) passos
+def _profundidades(pai):
+	ancestral = np.where(pai < 0, np.arange(len(pai)), pai)
+	profundidade = (pai >= 0).astype(np.int64)
+	while True:
+		proximo = ancestral[ancestral]
+		if np.array_equal(proximo, ancestral):
+			return profundidade
+		profundidade = profundidade + profundidade[ancestral]
+		ancestral = proximo
+
+# Constrói a floresta de todas as runs de um trace (Simulation.data) em uma passada vetorizada
+# Cada chegada é um nó; quem chega com o sistema vazio (N == 1 após a chegada) é a raiz de um novo período ocupado,
+# e os demais são filhos do cliente em serviço. Como a fila é FIFO, o cliente em serviço é o de número igual às
+# partidas já ocorridas na run
+# Consideramos árvores infinitas as incompletas no fim da run (N != 0 no último passo): são removidas se tiverem
+# até minimoParaInfinitude nós, e marcadas como infinitas caso contrário
+def construirFloresta(trace,minimoParaInfinitude=300):
+	if not trace.run.is_monotonic_increasing:
+		trace = trace.sort_values('run', kind='stable')
+	run = trace.run.to_numpy()
+	N = trace.N.to_numpy()
+	chegada = (trace.type == 'a').to_numpy()
+
+	_, inicios, contagens = np.unique(run, return_index=True, return_counts=True)
+	passos = np.arange(len(run)) - np.repeat(inicios, contagens) # Posição de cada evento no trace da run
+	# Partidas e chegadas anteriores a cada evento, dentro da run
+	partidasAntes = np.cumsum(~chegada) - ~chegada
+	partidasAntes -= np.repeat(partidasAntes[inicios], contagens)
+	chegadasAntes = np.cumsum(chegada) - chegada
+	primeiroNoDaRun = np.repeat(chegadasAntes[inicios], contagens)
+
+	nos = np.flatnonzero(chegada)
+	raiz = N[nos] == 1
+	pai = np.where(raiz, -1, primeiroNoDaRun[nos] + partidasAntes[nos])
+
+	# A última árvore de cada run é infinita se a run termina com clientes no sistema
+	periodo = np.cumsum(raiz) - 1
+	infinita = np.zeros(periodo[-1]+1 if len(periodo) > 0 else 0, dtype=bool)
+	ultimos = inicios + contagens - 1
+	incompletas = N[ultimos] != 0
+	infinita[periodo[chegadasAntes[ultimos] + chegada[ultimos] - 1][incompletas]] = True
+
+	# Remove as árvores infinitas pequenas e renumera os pais
+	remover = infinita & (np.bincount(periodo, minlength=len(infinita)) <= minimoParaInfinitude)
+	manter = ~remover[periodo]
+	novoIndice = np.cumsum(manter) - 1
+	pai = np.where(pai < 0, -1, novoIndice[np.maximum(pai, 0)])[manter]
+
+	return Floresta(run[nos][manter], passos[nos][manter], pai, infinita[~remover])
+
+# Simula as filas e constrói a floresta dos períodos ocupados (ver construirFloresta)
+def gerarFloresta(lamda,mu,kind,runs=300,max_time=3000,max_events=3000,minimoParaInfinitude=300):
 	trace = simulations.queue_sim(lamda,mu,max_time=max_time,max_events=max_events,runs=runs,kind=kind,export=False).data
+	return construirFloresta(trace,minimoParaInfinitude)
 
-	arvores = []
-	for runAtual in range(0,runs):
-		traceDaRun = trace[trace.run==runAtual]
-
-		filaDeNos = queue.Queue()
-		arvAtual = None
-		noAtual = None
-
-		for passo in range(0,len(traceDaRun)):
-			if traceDaRun.iloc[passo]['type'] == 'a':
-				if noAtual == None: # Se há uma chegada e nenhum nó está sendo servido, temos um período ocupado novo
-					arvAtual = Tree()
-					arvores.append(arvAtual)
-					arvAtual.create_node("Chegada no instante " + str(passo), passo)
-					noAtual = passo
-				else: # Se há uma chegada, o novo cliente é filho do cliente que está sendo servido no momento
-					arvAtual.create_node("Chegada no instante " + str(passo), passo, noAtual)
-					filaDeNos.put(passo) # Temos uma fila de nós para que todos os clientes constem como servidos na ordem certa
-			else:
-				if not filaDeNos.empty():
-					noAtual = filaDeNos.get()
-				else:
-					noAtual = None
-
-		# Consideramos árvores infinitas, mas as marcamos como tal
-		if traceDaRun.iloc[len(traceDaRun)-1]['N'] != 0:
-			if arvAtual.size() <= minimoParaInfinitude:
-				arvores.remove(arvAtual)
-			else:
-				idRaiz = arvAtual.root
-				arvAtual.get_node(idRaiz).data = "inf"
-
-	return arvores
+# Cria árvores (processos de ramificação) baseado em um trace da simulação
+# As árvores treelib são montadas a partir da floresta em arrays (ver gerarFloresta)
+def gerarArvores(lamda,mu,kind,runs=300,max_time=3000,max_events=3000,minimoParaInfinitude=300):
+	return gerarFloresta(lamda,mu,kind,runs,max_time,max_events,minimoParaInfinitude).arvores()
 
 def plotarCDF(dicionario): # Plota a CDF dado uma distribuição em forma de dicionário
 	largura = 1.0
@@ -0,0 +1,26 @@
+import heapq
+from collections import namedtuple
+
+# registro leve de evento: seq desempata eventos simultâneos na ordem de agendamento
+Event = namedtuple('Event', ['time', 'seq', 'type', 'duration'])
+
+#calendário de eventos futuros baseado em heap, compartilhado pelas filas m/x/1 e m/x/k
+class EventCalendar:
+  __slots__ = ('_heap', '_seq')
+
+  def __init__(self):
+    self._heap = []
+    self._seq = 0
+
+  def __len__(self):
+    return len(self._heap)
+
+  #agenda um evento e retorna o seu número de sequência, que o identifica quando sair do calendário
+  def schedule(self, etype, time, duration = float('nan')):
+    seq = self._seq
+    heapq.heappush(self._heap, Event(time, seq, etype, duration))
+    self._seq = seq + 1
+    return seq
+
+  def pop(self) -> Event:
+    return heapq.heappop(self._heap)
@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+
+#códigos do tipo de evento: a coluna type é guardada como int8 e exposta como categórica
+ARRIVAL, SERVICE = 0, 1
+EVENT_TYPES = ['a', 's']
+
+#garante espaço para mais extra linhas nas colunas de um log colunar, dobrando a capacidade
+#exact = True aloca exatamente o necessário, quando o número de linhas já é conhecido
+def _reserve(log, columns, extra, exact = False):
+  needed = log.size + int(extra)
+  capacity = getattr(log, columns[0]).shape[0]
+  if(needed <= capacity):
+    return
+  if(exact):
+    capacity = needed
+  while(capacity < needed):
+    capacity *= 2
+  for column in columns:
+    old = getattr(log, column)
+    new = np.empty(capacity, dtype = old.dtype)
+    new[:log.size] = old[:log.size]
+    setattr(log, column, new)
+
+#tabela colunar dos clientes atendidos, uma linha por partida: run, instante de chegada, de início
+#do serviço e de partida, e o servidor que atendeu (0 nas filas de um servidor)
+#espera na fila, permanência e serviço saem direto das colunas, sem casar chegadas com partidas
+class CustomerLog:
+  __slots__ = ('run', 'arrival', 'start', 'departure', 'server', 'size')
+  columns = ('run', 'arrival', 'start', 'departure', 'server')
+
+  def __init__(self, capacity = 1024):
+    capacity = max(1, int(capacity))
+    self.run = np.empty(capacity, dtype = np.int32)
+    self.arrival = np.empty(capacity, dtype = np.float64)
+    self.start = np.empty(capacity, dtype = np.float64)
+    self.departure = np.empty(capacity, dtype = np.float64)
+    self.server = np.empty(capacity, dtype = np.int16)
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  #aloca de uma vez o espaço para mais extra clientes
+  def reserve(self, extra):
+    _reserve(self, self.columns, extra, exact = True)
+
+  def append(self, run, arrival, start, departure, server = 0):
+    if(self.size == self.run.shape[0]):
+      _reserve(self, self.columns, 1)
+    i = self.size
+    self.run[i] = run
+    self.arrival[i] = arrival
+    self.start[i] = start
+    self.departure[i] = departure
+    self.server[i] = server
+    self.size = i + 1
+
+  def extend(self, run, arrival, start, departure, server = 0):
+    n = len(arrival)
+    _reserve(self, self.columns, n)
+    i, j = self.size, self.size + n
+    self.run[i:j] = run
+    self.arrival[i:j] = arrival
+    self.start[i:j] = start
+    self.departure[i:j] = departure
+    self.server[i:j] = server
+    self.size = j
+
+  #colunas brutas (run, arrival, start, departure, server)
+  def arrays(self):
+    n = self.size
+    return tuple(getattr(self, column)[:n] for column in self.columns)
+
+  @classmethod
+  def from_arrays(cls, run, arrival, start, departure, server):
+    log = cls(capacity = len(arrival))
+    log.extend(run, arrival, start, departure, server)
+    return log
+
+  #tabela como DataFrame, com a espera na fila (delay), a permanência (sojourn) e o serviço
+  def to_frame(self) -> pd.DataFrame:
+    run, arrival, start, departure, server = self.arrays()
+    return pd.DataFrame({
+      'run' : run,
+      'arrival' : arrival,
+      'start' : start,
+      'departure' : departure,
+      'server' : server,
+      'delay' : start - arrival,
+      'sojourn' : departure - arrival,
+      'service' : departure - start
+    })
+
+#ledger colunar: arrays tipados pré-alocados que crescem por duplicação
+#com customers = True também guarda a tabela de clientes (um CustomerLog em ledger.customers),
+#que os motores preenchem junto com os eventos
+#compact() troca as colunas brutas pelas colunas do DataFrame e libera as brutas: fica só a última
+#amostra de cada run, descartada pelo compact, para reconstruí-las se o ledger voltar a ser escrito
+class Ledger:
+  __slots__ = ('type', 'time', 'duration', 'N', 'run', 'size', 'customers', '_compact', '_tail')
+  columns = ('type', 'time', 'duration', 'N', 'run')
+
+  def __init__(self, capacity = 1024, customers = False):
+    capacity = max(1, int(capacity))
+    self.type = np.empty(capacity, dtype = np.int8)
+    self.time = np.empty(capacity, dtype = np.float64)
+    self.duration = np.empty(capacity, dtype = np.float64)
+    self.N = np.empty(capacity, dtype = np.int32)
+    self.run = np.empty(capacity, dtype = np.int32)
+    self.size = 0
+    self.customers = CustomerLog() if customers else None
+    self._compact = None
+    self._tail = None
+
+  def __len__(self):
+    return self.size
+
+  def _reserve(self, extra, exact = False):
+    if(self._tail is not None):
+      self._expand()
+    _reserve(self, self.columns, extra, exact)
+
+  #aloca de uma vez o espaço para mais extra eventos (e clientes), quando o total já é conhecido,
+  #em vez de dobrar a capacidade várias vezes
+  def reserve(self, extra, customers = 0):
+    self._reserve(extra, exact = True)
+    if(self.customers is not None):
+      self.customers.reserve(customers)
+
+  #registra um evento: tipo (ARRIVAL/SERVICE), instante, duração do serviço e N após o evento
+  def append(self, etype, time, duration, N, run = 0):
+    if(self._tail is not None or self.size == self.time.shape[0]):
+      self._reserve(1)
+    i = self.size
+    self.type[i] = etype
+    self.time[i] = time
+    self.duration[i] = duration
+    self.N[i] = N
+    self.run[i] = run
+    self.size = i + 1
+    self._compact = None
+
+  #registra um bloco de eventos já em arrays
+  def extend(self, etype, time, duration, N, run = 0):
+    n = len(time)
+    self._reserve(n)
+    i, j = self.size, self.size + n
+    self.type[i:j] = etype
+    self.time[i:j] = time
+    self.duration[i:j] = duration
+    self.N[i:j] = N
+    self.run[i:j] = run
+    self.size = j
+    self._compact = None
+
+  #colunas brutas (type, time, duration, N, run), na ordem de extend
+  #depois de compact() são reconstruídas a cada chamada, sem voltar a guardá-las
+  def arrays(self):
+    if(self._tail is not None):
+      return self._raw_arrays()
+    n = self.size
+    return self.type[:n], self.time[:n], self.duration[:n], self.N[:n], self.run[:n]
+
+  #reconstrói um ledger a partir das colunas brutas de arrays()
+  @classmethod
+  def from_arrays(cls, type, time, duration, N, run):
+    ledger = cls(capacity = len(time))
+    ledger.extend(type, time, duration, N, run)
+    return ledger
+
+  #acrescenta os eventos (e os clientes, se os dois guardam a tabela) de outro ledger
+  def merge(self, other):
+    self.extend(*other.arrays())
+    if(self.customers is not None and other.customers is not None):
+      self.customers.extend(*other.customers.arrays())
+    return self
+
+  #calcula o holding de cada evento e remove a última amostra de cada run,
+  #pois não é possível calcular o tempo do estado
+  #as colunas brutas são liberadas: das durações só ficam as dos serviços (as das chegadas são nan),
+  #e as amostras removidas ficam em _tail para reconstruí-las (ver _raw_arrays)
+  def compact(self):
+    if(self._compact is None):
+      n = self.size
+      type, time, duration, N, run = self.arrays()
+      holding = time[1:] - time[:-1]
+      keep = np.zeros(n, dtype = bool)
+      keep[:-1] = run[1:] == run[:-1]
+      kept = np.flatnonzero(keep)
+      compact_type = type[kept]
+      self._compact = {
+        'type' : compact_type,
+        'time' : time[kept],
+        'N' : N[kept],
+        'run' : run[kept],
+        'holding' : holding[kept],
+        'service_duration' : duration[kept][compact_type == SERVICE]
+      }
+      removed = np.flatnonzero(~keep)
+      self._tail = {
+        'index' : removed,
+        'type' : type[removed],
+        'time' : time[removed],
+        'duration' : duration[removed],
+        'N' : N[removed],
+        'run' : run[removed]
+      }
+      self.type = self.time = self.duration = self.N = self.run = None
+    return self._compact
+
+  #colunas brutas a partir das colunas compactas e das amostras removidas
+  def _raw_arrays(self):
+    columns, tail = self._compact, self._tail
+    kept = np.ones(self.size, dtype = bool)
+    kept[tail['index']] = False
+    duration = np.full(columns['type'].shape[0], np.nan)
+    duration[columns['type'] == SERVICE] = columns['service_duration']
+    raw = []
+    for column, values in zip(self.columns, (columns['type'], columns['time'], duration, columns['N'], columns['run'])):
+      array = np.empty(self.size, dtype = values.dtype)
+      array[kept] = values
+      array[~kept] = tail[column]
+      raw.append(array)
+    return tuple(raw)
+
+  #volta às colunas brutas para o ledger poder ser escrito de novo
+  def _expand(self):
+    self.type, self.time, self.duration, self.N, self.run = self._raw_arrays()
+    self._compact = None
+    self._tail = None
+
+  #expõe o ledger como DataFrame sem copiar as colunas
+  def to_frame(self) -> pd.DataFrame:
+    columns = self.compact()
+    return pd.DataFrame({
+      'type' : pd.Categorical.from_codes(columns['type'], categories = EVENT_TYPES),
+      'time' : columns['time'],
+      'N' : columns['N'],
+      'run' : columns['run'],
+      'holding' : columns['holding']
+    }, copy = False)
+
+  #durações dos serviços, indexadas pela linha do evento de serviço no DataFrame
+  def service_durations(self) -> pd.Series:
+    columns = self.compact()
+    services = np.flatnonzero(columns['type'] == SERVICE)
+    return pd.Series(columns['service_duration'], index = services, name = 'duration')
@@ -2,20 +2,34 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import math
+import os
 from datetime import datetime
 import abc
+import heapq
+from collections import deque
 import analytical as an
 
 from pandas.core.frame import DataFrame
 
 from plot_metrics import plot_mm1_wait_dist, plot_mmk_customers_dist
-from simulations import Simulation
+from simulated_metrics import confidence_interval
+from simulations import Simulation, _queue_sim, _draw_customers, _merge_events, _simulate_batch
+from simulations import queue_sim_key as _queue_sim_key
+from variates import VariateSource
+from event_calendar import EventCalendar
+from ledger import Ledger, ARRIVAL, SERVICE
 
 
 #classe Simulação MD1
 class MMKSimulation(Simulation):
-  def __init__(self, lamda, mu, k, data, service_durations):
+  model = 'mmk'
+  def __init__(self, lamda, mu, k, data, service_durations, kind = 'm'):
     self.k = k
+    self.kind = kind
+    #a M/D/k não tem distribuição, espera nem número médio de clientes em forma fechada:
+    #sem modelo analítico, essas métricas são nan e os gráficos não mostram a curva analítica
+    if(kind != 'm'):
+      self.model = None
     super().__init__(lamda, mu, data, service_durations)
     
   def __repr__(self) -> str:
@@ -25,122 +39,198 @@ class MMKSimulation(Simulation):
   
   @property
   def pdf(self):
-    P = an.mmk_markov_chain(self.lamda, self.mu, self.k)
-    pi = an.ctmc_stationary_distribution(P)
+    pi = self._stationary_distribution()
     return pi
+  #métricas em forma fechada pela fórmula de Erlang C (ver analytical.erlang_c)
   @property
   def average_wait(self):
-    if(self.rho > self.k):
-      return math.inf
-    return self.average_customers/ self.lamda
+    if(self.model is None):
+      return math.nan
+    return float(an.mmk_average_wait(self.lamda, self.mu, self.k))
   @property
   def average_customers(self):
-    if(self.rho > self.k):
-      return math.inf
-    return an.expected_value(self.pdf)
+    if(self.model is None):
+      return math.nan
+    return float(an.mmk_average_customers(self.lamda, self.mu, self.k))
+  #utilização por servidor, lamda/(k mu), que vale para qualquer distribuição de serviço; a simulada é E[min(N, k)]/k (ver simulated_metrics.RunSummary)
   @property
   def utilization(self):
-    if(self.rho > self.k):
-      return 1
-    u = sum(self.pdf[1:])
-    return u
+    return float(an.mmk_utilization(self.lamda, self.mu, self.k))
+  #utilização de cada servidor (fração do tempo ocupado), a partir da tabela de clientes
+  #o servidor livre de menor número é sempre ocupado primeiro, então as utilizações caem com o
+  #número do servidor; só a média entre os servidores (linha 'mean') tem valor analítico, lamda/(k mu)
+  @property
+  def server_utilization(self):
+    assert self.customers is not None, 'simule com customers = True'
+    summary = self.summary
+    samples = pd.DataFrame(summary.server_busy / summary.total_time[:, None])
+    samples['mean'] = samples.mean(axis = 1)
+    return pd.DataFrame({
+      'Simulated' : samples.mean(),
+      'Confidence Interval' : [confidence_interval(samples[server]) for server in samples],
+      'Analytical' : [np.nan] * (samples.shape[1] - 1) + [self.utilization]
+    }).rename_axis('server')
+
   def plot_customers(self, figsize = (10,5), **kwargs):
     plot_mmk_customers_dist(self, figsize = figsize, **kwargs)
   
   def plot_wait(self, figsize=(10,5), **kwargs):
     plot_mm1_wait_dist(self, figsize=figsize, **kwargs)
 
-# simula uma única fila mm1 ou md1, baseado no parametro kind
-def m_queue(lamda, mu, k, max_time = 1000, max_events = 1000, kind = 'm'):
+  def export_to_csv(self):
+    time_str = datetime.now().strftime("%Y_%m_%d-%I_%M_%S_%p")
+    type_str = f"M{self.kind.upper()}{self.k}"
+    filename = f"Simulation_{type_str}_{time_str}_{self.lamda}_{self.mu}.csv"
+    os.makedirs('exports', exist_ok=True)
+    self.data.to_csv(f'exports/{filename}')
+    return
+
+# simula uma única fila mmk ou mdk, baseado no parametro kind
+# registra os eventos em ledger (um novo Ledger se None) com o número da run
+# seed define os fluxos de chegadas e serviços da run (ver variates.VariateSource)
+def m_queue(lamda, mu, k, max_time = 1000, max_events = 1000, kind = 'm', ledger = None, run = 0, seed = None):
   assert kind in ['m','d']
-  wait_function = lambda x: np.random.exponential(1/x) if kind == 'm' else 1/mu
+  variates = VariateSource(lamda, mu, kind = kind, seed = seed)
+  next_interarrival, next_service = variates.interarrival, variates.service
     
   time = 0
   nevents = 0
-  ledger = []
+  if(ledger is None):
+    ledger = Ledger()
   #fila de eventos, arrival @ t = 0
-  equeue = [{
-    'type' : 'a',
-    'time' : time
-    }]
+  equeue = EventCalendar()
+  equeue.schedule(ARRIVAL, time)
 
-  
   def schedule_service():
-    service_duration = wait_function(mu)
-    service_time = time + service_duration
-    equeue.append({
-      'type' : 's',
-      'time' : service_time,
-      'duration' : service_duration
-      })
+    service_duration = next_service()
+    return equeue.schedule(SERVICE, time + service_duration, service_duration)
   def schedule_arrival():
-    equeue.append({
-      'type' : 'a',
-      'time' : time +  np.random.exponential(1/lamda),
-      })
-    
+    equeue.schedule(ARRIVAL, time + next_interarrival())
+
+  #estado dos servidores: chegadas dos clientes esperando, em ordem FIFO, servidores livres (o de
+  #menor número é ocupado primeiro) e (chegada, início, servidor) de cada serviço em andamento,
+  #pelo número de sequência do evento de partida; a tabela de clientes (ver ledger.CustomerLog)
+  #recebe cada cliente na partida
+  customers = ledger.customers
+  waiting = deque()
+  free_servers = list(range(k))
+  in_service = {}
+  def start_service():
+    seq = schedule_service()
+    in_service[seq] = (waiting.popleft(), time, heapq.heappop(free_servers))
 
   #variavel aleatória que representa o no de pessoas na fila
   N = 0
-  serving = 0
 
   while(nevents < max_events and time < max_time):
     nevents += 1
-    event = equeue.pop(0)
-    time, etype = event['time'] , event['type']
-    if(etype == 'a'):
+    time, seq, etype, duration = equeue.pop()
+    if(etype == ARRIVAL):
       N += 1
+      waiting.append(time)
       if(N <= k):
-        schedule_service()
+        start_service()
       schedule_arrival()
-      equeue = sorted(equeue, key = lambda x : x['time'])
     else:
       N -= 1
+      arrival, start, server = in_service.pop(seq)
+      heapq.heappush(free_servers, server)
+      if(customers is not None):
+        customers.append(run, arrival, start, time, server)
       if(N >= k):
-        schedule_service()
+        start_service()
 
-      equeue = sorted(equeue, key = lambda x : x['time'])
-    
-    event['N'] = N
-    #event['serving'] = serving
-    ledger.append(event)
-    #print(ledger)
+    ledger.append(etype, time, duration, N, run)
   return ledger
 
-# simula multiplas filas mm1 ou md1
-def queue_sim(lamda, mu, k, max_time = 1000, max_events = 1000, runs = 10, kind = 'm', export = False):
+# recursão de Kiefer-Wolfowitz de filas FIFO com k servidores, vetorizada entre as filas (linhas):
+# o vetor de carga guarda o instante em que cada servidor fica livre, e cada cliente ocupa o servidor
+# livre de menor número ou, se todos estão ocupados, o que se libera primeiro, como no laço de eventos
+# o laço é sobre os clientes e cada passo opera no array (filas x k) inteiro; o vetor não é mantido
+# ordenado porque a identidade dos servidores é registrada, e o mínimo custa O(k) de qualquer forma
+# o laço para, em blocos de block clientes, quando todas as filas já têm os eventos que o critério de
+# parada registra (ver _kiefer_wolfowitz_done), em vez de percorrer todos os clientes sorteados
+# retorna os inícios, as partidas e os servidores dos clientes percorridos
+def _kiefer_wolfowitz(arrivals, services, k, max_time = math.inf, max_events = math.inf, block = 128):
+  runs, n = arrivals.shape
+  rows = np.arange(runs)
+  free = np.zeros((runs, k))
+  starts = np.empty((runs, n))
+  servers = np.empty((runs, n), dtype = np.int16)
+  m = 0
+  while(m < n):
+    for i in range(m, min(m + block, n)):
+      arrival = arrivals[:, i]
+      idle = free <= arrival[:, None]
+      server = np.where(idle.any(axis = 1), idle.argmax(axis = 1), free.argmin(axis = 1))
+      start = np.maximum(arrival, free[rows, server])
+      free[rows, server] = start + services[:, i]
+      starts[:, i] = start
+      servers[:, i] = server
+    m = min(m + block, n)
+    if(_kiefer_wolfowitz_done(arrivals, starts, k, m, block, max_time, max_events)):
+      break
+  return starts[:, :m], starts[:, :m] + services[:, :m], servers[:, :m]
+
+# com os m primeiros clientes percorridos, todos os eventos até a chegada do cliente m são conhecidos,
+# pois os seguintes chegam (e partem) depois dela; a fila está pronta se essa chegada passou de
+# max_time ou se já há max_events eventos até ela
+# os inícios são crescentes (FIFO), então quem espera no instante h é um sufixo dos clientes; se o
+# último bloco inteiro espera, a fila pode ser maior e a contagem fica para o próximo bloco
+# com no máximo k clientes em serviço, as partidas até h são pelo menos m - esperando - k
+def _kiefer_wolfowitz_done(arrivals, starts, k, m, block, max_time, max_events):
+  horizon = arrivals[:, m - 1]
+  last = min(block, m)
+  waiting = (starts[:, m - last:m] > horizon[:, None]).sum(axis = 1)
+  events = m + (m - waiting - k)
+  return bool(np.all((horizon >= max_time) | ((waiting < last) & (events >= max_events))))
+
+# eventos (ver simulations._merge_events) e colunas dos clientes de filas mmk ou mdk, uma por semente
+def _kiefer_wolfowitz_events(lamda, mu, k, seeds, max_time, max_events, kind):
+  arrivals, services = _draw_customers(lamda, mu, seeds, max_time, max_events, kind)
+  starts, departures, servers = _kiefer_wolfowitz(arrivals, services, k, max_time, max_events)
+  m = starts.shape[1]
+  arrivals, services = arrivals[:, :m], services[:, :m]
+  return _merge_events(arrivals, services, departures, max_time, max_events), (arrivals, starts, departures, servers)
+
+# simula todas as filas mmk ou mdk FIFO juntas como arrays (runs x clientes), uma por semente, e
+# registra os eventos das runs first_run, first_run + 1, ... em um único Ledger (ver simulations._simulate_batch)
+# para a mesma semente gera os mesmos eventos (e a mesma tabela de clientes) que m_queue
+def kiefer_wolfowitz_batch(lamda, mu, k, max_time = 1000, max_events = 1000, kind = 'm', ledger = None, first_run = 0, seeds = None):
   assert kind in ['m','d']
+  return _simulate_batch(lambda seeds: _kiefer_wolfowitz_events(lamda, mu, k, seeds, max_time, max_events, kind),
+    lamda, max_time, max_events, ledger, first_run, seeds)
+#simula todas as runs em uma chamada (ver simulations._simulate_runs)
+kiefer_wolfowitz_batch.batched = True
+
+# chave de cache da simulação que queue_sim faria com esses argumentos, para cache.invalidate(queue_sim_key(cache, ...))
+# options são os mesmos argumentos de simulations.queue_sim_key, que monta a chave
+def queue_sim_key(cache, lamda, mu, k, **options):
+  return _queue_sim_key(cache, lamda, mu, model = 'mmk.queue_sim', k = k, **options)
+
+# simula multiplas filas mmk ou mdk
+# engine = 'events' usa o laço de eventos e engine = 'batched' simula todas as runs juntas como
+# arrays pela recursão de Kiefer-Wolfowitz (ver kiefer_wolfowitz_batch); cada passo do laço sobre os
+# clientes custa o mesmo que vários eventos, então 'batched' só compensa com muitas runs
+# seed é a semente raiz das runs; n_jobs/executor distribuem as runs entre processos
+# stream = True acumula as métricas durante o laço de eventos em vez de guardar o ledger
+# target_precision != None adiciona runs até atingir a precisão (ver simulations.simulate_to_precision,
+# que recebe precision_metrics, relative e max_runs)
+# cache (um cache.SimulationCache) devolve a simulação salva com os mesmos parâmetros e semente; a chave
+# fica em sim.cache_key (ou vem de queue_sim_key), para cache.invalidate
+# customers = True guarda a tabela de clientes, com o servidor de cada um, em sim.customers
+# (necessária para sim.server_utilization)
+def queue_sim(lamda, mu, k, max_time = 1000, max_events = 1000, runs = 10, kind = 'm', export = False, engine = 'events',
+  seed = None, n_jobs = 1, executor = None, stream = False, target_precision = None, cache = None, customers = False,
+  precision_metrics = ('wait', 'customers', 'utilization'), relative = True, max_runs = 100000):
+  assert kind in ['m','d']
+  assert engine in ['events', 'batched']
+  assert not stream or engine == 'events'
+  engine_function = {'events' : m_queue, 'batched' : kiefer_wolfowitz_batch}[engine]
 
-  ledger_df = []
-
-  for i in range(runs):
-      ledger = m_queue(lamda, mu, k, max_time = max_time, max_events = max_events, kind = kind)
-      ledger = pd.DataFrame(ledger)
-      ledger['run'] = i
-      ledger['holding'] = ledger.time.shift(-1) - ledger.time
-      ledger_df.append(ledger)
-
-  ledger_df = pd.concat(ledger_df)
-
-  #remove a última amostra, pois não é possível calcular o tempo do estado
-  ledger_df.dropna(how = 'any', axis = 0, subset = ['holding'], inplace = True)
-  ledger_df.reset_index(inplace=True, drop=True)
-
-  if(kind == 'm'):
-    service_df = ledger_df['duration'].rename({
-      'duration' : 'service_duration'
-    })
-    service_df.dropna(inplace=True)
-  else:
-    service_df = pd.Series({index : 1/mu for index in ledger_df[ledger_df.type == 's'].index},\
-      name = 'duration')
-
-  ledger_df.drop(columns=['duration'], inplace= True)
-
-  sim = MMKSimulation(lamda= lamda, mu = mu, k = k, data = ledger_df, service_durations= None)
-  if (export):
-    sim.export_to_excel()
-  return sim
-
-
+  def make_simulation(ledger, service_df):
+    return MMKSimulation(lamda= lamda, mu = mu, k = k, data = ledger, service_durations= service_df, kind = kind)
 
+  precision_kwargs = dict(precision_metrics = precision_metrics, relative = relative, max_runs = max_runs)
+  return _queue_sim(make_simulation, engine_function, lamda, mu, max_time, max_events, runs, kind, export, engine, seed,
+    n_jobs, executor, stream, target_precision, cache, customers, precision_kwargs, model = 'mmk.queue_sim', k = k)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import analytical as an
 from simulated_metrics import customers_dist, wait_dist, metrics
@@ -66,6 +67,27 @@ def _plot_cdf(simulated_distributions, analytical_cdf,  plot_analytical = True,
     kwargs.update(_kwargs)
     _plot(simulated_distributions['cdf'],simulated_distributions['cdf_CI'], analytical_cdf, plot_analytical= plot_analytical, figsize = figsize,**kwargs)
 
+#a curva analítica só existe para filas estáveis com forma fechada (não para a M/D/k)
+def _has_analytical(simulation_obj):
+    return simulation_obj.model is not None and simulation_obj.lamda < simulation_obj.k * simulation_obj.mu
+
+#a curva da permanência só vale para as esperas de cada cliente: com k > 1 servidores, sem a tabela de
+#clientes as esperas casam a n-ésima chegada com a n-ésima partida, que não é o mesmo cliente
+def _has_analytical_wait(simulation_obj):
+    return _has_analytical(simulation_obj) and (simulation_obj.k == 1 or simulation_obj.customers is not None)
+
+#pmf analítica da simulação nos estados 0, ..., size - 1 (zero além do truncamento de sim.pdf)
+def _analytical_pmf(simulation_obj, size):
+    pi = simulation_obj.pdf
+    pdf = np.zeros(size)
+    pdf[:min(size, len(pi))] = pi[:size]
+    return pdf
+
+#cdf analítica do tempo de permanência no fim de cada intervalo do histograma de esperas
+def _analytical_wait_cdf(simulation_obj, waits):
+    cdf = an.wait_time_cdf(simulation_obj.model, simulation_obj.lamda, simulation_obj.mu, waits.index.to_numpy(), k = simulation_obj.k)
+    return pd.Series(cdf, index = waits.index)
+
 #gera ticks do eixo x do plot de clientes
 def _customers_ticks(data, max_ticks = -1):
     x = data.index
@@ -77,8 +99,8 @@ def _customers_ticks(data, max_ticks = -1):
 
 #gera ticks do eixo x do plot de esperas
 def _waits_ticks(data):
-    xticks = [x[0] for x in data.index]
-    xlabels = [f'{x[0]:.2f}' for x in data.index]
+    xticks = data.index.to_numpy()
+    xlabels = [f'{x:.2f}' for x in xticks]
     return xticks, xlabels
 
 def plot_mm1_customers_dist(simulation_obj : MM1Simulation, trim = False, figsize = (10,5), **kwargs):
@@ -86,10 +108,7 @@ def plot_mm1_customers_dist(simulation_obj : MM1Simulation, trim = False, figsiz
     display(dists)
 
     should_plot_analytical = simulation_obj.rho < 1
-    Q = an.mm1_markov_chain(simulation_obj.lamda, simulation_obj.mu, capacity = dists.index.max() + 1)
-    pi = an.ctmc_stationary_distribution(Q)
-    
-    pdf = pi[:dists.index.max() + 1]
+    pdf = _analytical_pmf(simulation_obj, dists.index.max() + 1)
     cdf = pdf.cumsum()
 
     max_ticks = kwargs['max_ticks'] if 'max_ticks' in kwargs.keys() else -1
@@ -111,11 +130,9 @@ def plot_mmk_customers_dist(simulation_obj, figsize = (10,5),trim = False, **kwa
     dists = customers_dist(simulation_obj, trim = trim)
     display(dists)
 
-    should_plot_analytical = simulation_obj.rho < 1
-    Q = an.mmk_markov_chain(simulation_obj.lamda, simulation_obj.mu, simulation_obj.k, capacity = dists.index.max() + 1)
-    pi = an.ctmc_stationary_distribution(Q)
-    pdf = pi[:dists.index.max() + 1]
-    cdf = pdf.cumsum()
+    should_plot_analytical = _has_analytical(simulation_obj)
+    pdf = _analytical_pmf(simulation_obj, dists.index.max() + 1) if should_plot_analytical else None
+    cdf = pdf.cumsum() if should_plot_analytical else None
 
     max_ticks = kwargs['max_ticks'] if 'max_ticks' in kwargs.keys() else -1
     xticks = _customers_ticks(dists, max_ticks = max_ticks)
@@ -124,7 +141,7 @@ def plot_mmk_customers_dist(simulation_obj, figsize = (10,5),trim = False, **kwa
         'x_label' : 'queue_size',
         'xticks' : xticks,
         'title' : 'Queue Size PMF',
-        'subtitle' : f"M/M/{simulation_obj.k} λ = {simulation_obj.lamda}, μ = {simulation_obj.mu}, ρ = {simulation_obj.rho}"
+        'subtitle' : f"M/{simulation_obj.kind.upper()}/{simulation_obj.k} λ = {simulation_obj.lamda}, μ = {simulation_obj.mu}, ρ = {simulation_obj.rho}"
     }
     
     kwargs.update(_kwargs)
@@ -150,10 +167,8 @@ def plot_md1_customers_dist(simulation_obj : MD1Simulation, trim = False, figsiz
     }
     kwargs.update(_kwargs)
     if(should_plot_analytical):
-        P = an.md1_markov_chain(simulation_obj.lamda, simulation_obj.mu, capacity = dists.index.max() + 1)
-        pi = an.dtmc_stationary_distribution(P)
-        pdf = pi[:dists.index.max() + 1]
-        cdf = pi.cumsum()
+        pdf = _analytical_pmf(simulation_obj, dists.index.max() + 1)
+        cdf = pdf.cumsum()
     else:
         pdf = None,
         cdf = None
@@ -162,8 +177,8 @@ def plot_md1_customers_dist(simulation_obj : MD1Simulation, trim = False, figsiz
     kwargs.update({'title' : 'Queue Size CMF' })
     _plot_cdf(dists, cdf, figsize= figsize, plot_analytical =should_plot_analytical, **kwargs)
 
-def plot_mm1_wait_dist(simulation_obj : MM1Simulation, figsize = (10,5), **kwargs):
-    waits = wait_dist(simulation_obj)
+def plot_mm1_wait_dist(simulation_obj : MM1Simulation, figsize = (10,5), bins = 10, binning = 'fixed', **kwargs):
+    waits = wait_dist(simulation_obj, bins = bins, binning = binning)
     display(waits)
     xticks, xlabels = _waits_ticks(waits)
     _kwargs = {
@@ -171,17 +186,18 @@ def plot_mm1_wait_dist(simulation_obj : MM1Simulation, figsize = (10,5), **kwarg
         'xticks' : xticks,
         'xlabels' : xlabels,
         'title' : 'Waits CDF',
-        'subtitle' : f"M/M/1 λ = {simulation_obj.lamda}, μ = {simulation_obj.mu}, ρ = {simulation_obj.rho}"
+        'subtitle' : f"M/{getattr(simulation_obj, 'kind', 'm').upper()}/{simulation_obj.k} λ = {simulation_obj.lamda}, μ = {simulation_obj.mu}, ρ = {simulation_obj.rho}"
     }
     kwargs.update(_kwargs)
-    waits.index = [x[0] for x in waits.index]
+    should_plot_analytical = _has_analytical_wait(simulation_obj)
+    cdf = _analytical_wait_cdf(simulation_obj, waits) if should_plot_analytical else None
     #_plot_pdf(waits, None, plot_analytical = False, figsize= figsize, **kwargs)
-    _plot_cdf(waits, None, plot_analytical = False, figsize= figsize, **kwargs)
+    _plot_cdf(waits, cdf, plot_analytical = should_plot_analytical, figsize= figsize, **kwargs)
 
     return waits
 
-def plot_md1_wait_dist(simulation_obj : MD1Simulation, figsize = (10,5), **kwargs):
-    waits = wait_dist(simulation_obj)
+def plot_md1_wait_dist(simulation_obj : MD1Simulation, figsize = (10,5), bins = 10, binning = 'fixed', **kwargs):
+    waits = wait_dist(simulation_obj, bins = bins, binning = binning)
     display(waits)
     xticks, xlabels = _waits_ticks(waits)
     _kwargs = {
@@ -192,9 +208,10 @@ def plot_md1_wait_dist(simulation_obj : MD1Simulation, figsize = (10,5), **kwarg
         'subtitle' : f"M/D/1 λ = {simulation_obj.lamda}, μ = {simulation_obj.mu}, ρ = {simulation_obj.rho}"
     }
     kwargs.update(_kwargs)
-    waits.index = [x[0] for x in waits.index]
+    should_plot_analytical = _has_analytical_wait(simulation_obj)
+    cdf = _analytical_wait_cdf(simulation_obj, waits) if should_plot_analytical else None
     #_plot_pdf(waits, None, plot_analytical = False, figsize= figsize, **kwargs)
-    _plot_cdf(waits, None, plot_analytical = False, figsize= figsize, **kwargs)
+    _plot_cdf(waits, cdf, plot_analytical = should_plot_analytical, figsize= figsize, **kwargs)
     return waits
 
 def plot_average_metrics(simulations_obj:  list(MD1Simulation), figsize = (10,5), **kwargs):
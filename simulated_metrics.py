@@ -9,11 +9,8 @@ if TYPE_CHECKING:
 #calcula a utilização
 #retorna um dicionário com a utilização simulada e analitica
 def utilization(simulation_obj : Simulation):
-  simulation = simulation_obj.data
-  busy_time = simulation[simulation.N > 0].groupby('run').holding.sum()
-  total_time = simulation.groupby('run').holding.sum()
-  
-  utilization = busy_time/total_time
+  summary = simulation_obj.summary
+  utilization = pd.Series(summary.busy_time/summary.total_time)
 
   ci = confidence_interval(utilization)
 
@@ -30,12 +27,9 @@ def utilization(simulation_obj : Simulation):
 #calcula a média de clientes na fila
 #retorna um dicionário com a média simulada e analitica
 def customers_metrics(simulation_obj : Simulation):
-  simulation = simulation_obj.data
-  runs_groupby = simulation.groupby('run')
-  total_time = runs_groupby.time.last()
-  temp_df = simulation.copy()
-  temp_df['area'] = temp_df.holding * temp_df.N
-  areas = temp_df.groupby('run').area.sum()
+  summary = simulation_obj.summary
+  total_time = pd.Series(summary.last_time)
+  areas = pd.Series(summary.area)
 
   customers_df = {
     'Average Customers' :{
@@ -54,62 +48,156 @@ def confidence_interval(samples, confidence_rate = 1.95):
   z = confidence_rate
   return (x - z*(s/ math.sqrt(n) ), x+ z*(s/  math.sqrt(n) ))
 
+#resumo por run de uma simulação, calculado uma vez em uma passada sobre as colunas do ledger
+#(bincount sobre o índice da run, sem groupby) e reaproveitado por todas as métricas e
+#distribuições; fica guardado em Simulation.summary
+class RunSummary:
+
+  #customers é a tabela de clientes da simulação (ledger.CustomerLog), se houver: as esperas saem
+  #direto dela (e também a espera na fila), em vez do casamento de chegadas com partidas
+  #servers é o número de servidores: o tempo ocupado pondera cada estado por min(N, servers)/servers,
+  #a fração de servidores ocupados (com um servidor, o tempo com N > 0)
+  def __init__(self, simulation, customers = None, servers = 1):
+    if(not simulation.run.is_monotonic_increasing):
+      simulation = simulation.sort_values('run', kind = 'stable')
+    runs, time = simulation.run.to_numpy(), simulation.time.to_numpy()
+    holding, N = simulation.holding.to_numpy(), simulation.N.to_numpy().astype(np.int64)
+    is_service = (simulation.type == 's').to_numpy()
+
+    self.runs, starts, counts = np.unique(runs, return_index = True, return_counts = True)
+    n_runs = self.runs.shape[0]
+    run_index = np.repeat(np.arange(n_runs), counts)
+    #tempo total, tempo ocupado, área sob N(t), instante do último evento e maior estado de cada run
+    self.total_time = np.bincount(run_index, weights = holding, minlength = n_runs)
+    self.busy_time = np.bincount(run_index, weights = holding * np.minimum(N, servers) / servers, minlength = n_runs)
+    self.area = np.bincount(run_index, weights = holding * N, minlength = n_runs)
+    self.last_time = time[starts + counts - 1]
+    self.max_state = np.maximum.reduceat(N, starts) if n_runs > 0 else N[:0]
+    self.departures = np.bincount(run_index[is_service], minlength = n_runs)
+    self.arrivals = counts - self.departures
+
+    if(customers is None):
+      #tempos de permanência, casando a k-ésima chegada com o k-ésimo serviço de cada run
+      #k é a contagem acumulada dos eventos de cada tipo dentro da run, obtida da posição no array
+      arrival_runs, arrival_times = runs[~is_service], time[~is_service]
+      self.service_runs, service_times = runs[is_service], time[is_service]
+      k = np.arange(self.service_runs.shape[0]) - np.searchsorted(self.service_runs, self.service_runs, side = 'left')
+      matching = np.searchsorted(arrival_runs, self.service_runs, side = 'left') + k
+      self.waits = service_times - arrival_times[matching]
+      self.delays = None
+      self.server_busy = None
+      service_index = run_index[is_service]
+    else:
+      customer_run, arrival, start, departure, server = customers.arrays()
+      order = np.argsort(customer_run, kind = 'stable')
+      self.service_runs = customer_run[order]
+      self.waits = (departure - arrival)[order]
+      self.delays = (start - arrival)[order]
+      service_index = np.searchsorted(self.runs, self.service_runs)
+      #tempo ocupado de cada servidor em cada run, uma matriz (runs x servidores), incluindo os
+      #servidores que não atenderam ninguém
+      server = server[order].astype(np.int64)
+      n_servers = max(servers, int(server.max(initial = 0)) + 1)
+      self.server_busy = np.bincount(service_index * n_servers + server, weights = (departure - start)[order],
+        minlength = n_runs * n_servers).reshape(n_runs, n_servers)
+    self.served = np.bincount(service_index, minlength = n_runs)
+    self.sojourn_sum = np.bincount(service_index, weights = self.waits, minlength = n_runs)
+    self.delay_sum = None if self.delays is None else np.bincount(service_index, weights = self.delays, minlength = n_runs)
+
+    #tempo que cada run passou em cada estado, uma matriz (runs x estados)
+    states = int(N.max(initial = 0)) + 1
+    self.occupancy = np.bincount(run_index * states + N, weights = holding, minlength = n_runs * states)\
+      .reshape(n_runs, states)
+
+  def __len__(self):
+    return self.runs.shape[0]
+
+  #espera média de cada run com ao menos um serviço concluído
+  @property
+  def wait_mean(self):
+    served = self.served > 0
+    return self.sojourn_sum[served] / self.served[served]
+
+  #espera média na fila de cada run com ao menos um serviço concluído (só com a tabela de clientes)
+  @property
+  def delay_mean(self):
+    if(self.delay_sum is None):
+      return None
+    served = self.served > 0
+    return self.delay_sum[served] / self.served[served]
+
+  #médias por run das métricas de metrics(), como em StreamingStats.run_samples
+  def run_samples(self):
+    return {
+      'customers' : self.area / self.last_time,
+      'utilization' : self.busy_time / self.total_time,
+      'wait' : self.wait_mean
+    }
+
+#amostras por run de média de clientes, utilização e espera média, as mesmas de metrics()
+def run_samples(simulation, servers = 1):
+  return RunSummary(simulation, servers = servers).run_samples()
+
 #calcula o tempo médio de espera e o tempo médio total que o cliente fica na fila
 #retorna um dicionário com as métricas simuladas e analíticas
 def wait_metric(simulation_obj : Simulation):
-  simulation = simulation_obj.data
-  services_df = simulation[simulation.type =='s']
-
-  services_by_run = services_df.groupby('run')
-  arrivals_df = simulation[simulation.type =='a']
+  summary = simulation_obj.summary
+  means = pd.DataFrame({
+    'wait' : summary.wait_mean
+  })
+  _wait_metrics = {}
+  #a espera na fila depende do início do serviço, que só a tabela de clientes registra
+  if(summary.delay_mean is not None):
+    means['delay'] = summary.delay_mean
+    _wait_metrics["Delay"] = {
+      "Simulated" : means.delay.mean(),
+      "Confidence Interval" : confidence_interval(means.delay),
+      'Analytical': simulation_obj.average_delay
+    }
 
-  arrivals_by_run = arrivals_df.groupby('run')
-  means = {
-    #'delay':[],
-    'wait' : []
+  _wait_metrics["Wait"] = {
+    'Simulated' : means.wait.mean(),
+    "Confidence Interval" : confidence_interval(means.wait),
+    'Analytical':  simulation_obj.average_wait
   }
-  for idx, services in services_by_run:
-    services = services.reset_index()['time']
-    services_count = services.shape[0]
-    corresponding_arrivals = arrivals_by_run.get_group(idx).head(services_count).reset_index().time
-    arrivals_services = pd.merge(left = services, right = corresponding_arrivals,\
-      left_index= True, right_index= True)
-    arrivals_services.rename(columns ={
-      'time_x' : 'service_end',
-      'time_y' : 'arrival'
-    }, inplace = True)
-    
-    #arrivals_services['service_start'] = arrivals_services['service_end'] - arrivals_services['duration']
-
-    waits = arrivals_services.service_end  - arrivals_services.arrival
-    #queue_waits = arrivals_services.service_start - arrivals_services.arrival
-
-    #means['queue_wait'].append(queue_waits.mean())
-    means['wait'].append(waits.mean())
-  means = pd.DataFrame(means)
+  return _wait_metrics
 
 
-  return {
-    # "Delay" :{
-    #   "Simulated" : means.queue_wait.mean(),
-    #   "Confidence Interval" : confidence_interval(means.queue_wait),
-    #   'Analytical': simulation_obj.average_queue_wait()
-      
-    # },
-
+#calcula espera, média de clientes e utilização a partir dos acumuladores por run
+#de uma simulação em modo streaming (sem ledger)
+def streaming_metrics(simulation_obj : Simulation):
+  samples = {name : pd.Series(values) for name, values in simulation_obj.stats.run_samples().items()}
+  _wait_metrics = {
     "Wait" :{
-      'Simulated' : means.wait.mean(),
-      "Confidence Interval" : confidence_interval(means.wait),
+      'Simulated' : samples['wait'].mean(),
+      "Confidence Interval" : confidence_interval(samples['wait']),
       'Analytical':  simulation_obj.average_wait
-      
     }
   }
+  _customers_metrics = {
+    'Average Customers' :{
+      'Simulated':  samples['customers'].mean(),
+      'Confidence Interval' : confidence_interval(samples['customers']),
+      'Analytical' : simulation_obj.average_customers
+    }
+  }
+  _utilization_metric = {
+    "Utilization":{
+      "Simulated": samples['utilization'].mean(),
+      "Confidence Interval" : confidence_interval(samples['utilization']),
+      "Analytical": simulation_obj.utilization
+    }
+  }
+  return _wait_metrics, _customers_metrics, _utilization_metric
 
 
 def metrics(simulation_obj : Simulation):
-  _wait_metrics = wait_metric(simulation_obj)
-  _customers_metrics = customers_metrics(simulation_obj)
-  _utilization_metric = utilization(simulation_obj)
+  if(simulation_obj.stats is not None):
+    _wait_metrics, _customers_metrics, _utilization_metric = streaming_metrics(simulation_obj)
+  else:
+    _wait_metrics = wait_metric(simulation_obj)
+    _customers_metrics = customers_metrics(simulation_obj)
+    _utilization_metric = utilization(simulation_obj)
 
 
   _wait_metrics = pd.DataFrame.from_dict(_wait_metrics, orient= 'index')
@@ -122,140 +210,200 @@ def metrics(simulation_obj : Simulation):
   return metrics_df
 
 
-def wait_dist(simulation_obj : Simulation):
+#regra MSER-5 de remoção do aquecimento: agrupa as observações em lotes de 5 e escolhe o
+#truncamento d que minimiza a variância da média dos lotes restantes, sum((z_j - z_d)^2)/(m - d)^2,
+#procurando só na primeira metade da série. retorna quantas observações remover
+def mser5(values, weights = None, batch = 5):
+  values = np.asarray(values, dtype = np.float64)
+  weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype = np.float64)
+  m = values.shape[0] // batch
+  if(m < 2):
+    return 0
+  z = (values[:m * batch] * weights[:m * batch]).reshape(m, batch).sum(axis = 1) \
+    / weights[:m * batch].reshape(m, batch).sum(axis = 1)
+  #somas dos lotes j >= d, para todo d, de trás para frente
+  s1 = np.cumsum(z[::-1])[::-1]
+  s2 = np.cumsum((z * z)[::-1])[::-1]
+  remaining = np.arange(m, 0, -1)
+  statistic = (s2 - s1 * s1 / remaining) / (remaining * remaining)
+  d = int(np.argmin(statistic[:m // 2 + 1]))
+  return d * batch
+
+#médias em lotes com tamanho automático: começa com initial_batches lotes e dobra o tamanho
+#(juntando lotes vizinhos) enquanto a autocorrelação lag-1 das médias dos lotes passar de
+#max_autocorrelation e ainda houver pelo menos 2 * min_batches lotes
+#weights dá o peso de cada observação (por exemplo, o holding para médias no tempo)
+def batch_means(values, weights = None, initial_batches = 1024, min_batches = 20, max_autocorrelation = 0.2):
+  values = np.asarray(values, dtype = np.float64)
+  weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype = np.float64)
+  batch_size = max(1, values.shape[0] // initial_batches)
+  batches = values.shape[0] // batch_size
+  n = batches * batch_size
+  weighted_sums = (values[:n] * weights[:n]).reshape(batches, batch_size).sum(axis = 1)
+  weight_sums = weights[:n].reshape(batches, batch_size).sum(axis = 1)
+
+  def lag1(means):
+    centered = means - means.mean()
+    denominator = (centered * centered).sum()
+    return (centered[1:] * centered[:-1]).sum() / denominator if denominator > 0 else 0.0
+
+  while(batches >= 2 * min_batches and lag1(weighted_sums / weight_sums) > max_autocorrelation):
+    batches //= 2
+    batch_size *= 2
+    weighted_sums = weighted_sums[:2 * batches].reshape(batches, 2).sum(axis = 1)
+    weight_sums = weight_sums[:2 * batches].reshape(batches, 2).sum(axis = 1)
+
+  means = pd.Series(weighted_sums / weight_sums)
+  return {
+    'mean' : means.mean(),
+    'confidence_interval' : confidence_interval(means),
+    'batches' : batches,
+    'batch_size' : batch_size
+  }
+
+#estimativa em regime estacionário a partir de uma única run longa (médias em lotes)
+#warmup = 'mser5' remove o aquecimento de cada série pela regra MSER-5, None não remove nada
+#retorna a tabela de metrics() com o número e o tamanho dos lotes e as observações removidas
+#com a tabela de clientes as esperas são as de cada cliente, na ordem das partidas; sem ela, casam a
+#n-ésima chegada com a n-ésima partida, o que só é a espera de um mesmo cliente com um servidor
+def steady_state_metrics(simulation_obj : Simulation, run = 0, warmup = 'mser5', **batch_kwargs):
+  assert warmup in ['mser5', None]
+  if(simulation_obj.stats is not None):
+    raise ValueError('steady_state_metrics precisa da série de eventos da run, que o modo streaming não guarda')
   simulation = simulation_obj.data
+  run_df = simulation[simulation.run == run]
+  holding = run_df.holding.to_numpy()
+  N = run_df.N.to_numpy()
+  if(simulation_obj.customers is not None):
+    customer_run, arrival, _, departure, _ = simulation_obj.customers.arrays()
+    waits = (departure - arrival)[customer_run == run]
+  else:
+    summary = simulation_obj.summary
+    waits = summary.waits[summary.service_runs == run]
+
+  series = {
+    'Wait' : (waits, None, simulation_obj.average_wait),
+    'Average Customers' : (N, holding, simulation_obj.average_customers),
+    'Utilization' : (np.minimum(N, simulation_obj.k) / simulation_obj.k, holding, simulation_obj.utilization)
+  }
+  results = {}
+  for name, (values, weights, analytical) in series.items():
+    deleted = mser5(values, weights) if warmup == 'mser5' else 0
+    estimate = batch_means(values[deleted:], None if weights is None else weights[deleted:], **batch_kwargs)
+    results[name] = {
+      'Simulated' : estimate['mean'],
+      'Confidence Interval' : estimate['confidence_interval'],
+      'Analytical' : analytical,
+      'Batches' : estimate['batches'],
+      'Batch Size' : estimate['batch_size'],
+      'Warm-up Deleted' : deleted
+    }
 
-  services_df = simulation[simulation.type =='s']
-  services_by_run = services_df.groupby('run')
-  arrivals_df = simulation[simulation.type =='a']
-  arrivals_by_run = arrivals_df.groupby('run')
-
-  waits = []
-  for idx, services in services_by_run:
-    services = services.reset_index()['time']
-    services_count = services.shape[0]
-    corresponding_arrivals = arrivals_by_run.get_group(idx).head(services_count).reset_index().time
-
-    arrivals_services = pd.merge(left = services, right = corresponding_arrivals,\
-      left_index= True, right_index= True)
-    
-    arrivals_services.rename(columns ={
-      'time_x' : 'service_end',
-      'time_y' : 'arrival'
-    }, inplace = True)
-
-    waits_N_run = arrivals_services.service_end  - arrivals_services.arrival
-    waits_N_run['run'] = idx
-    waits.append(waits_N_run)
-
-  waits = pd.DataFrame(waits)
-  waits.run = waits.run.astype(int)
-  waits = waits.set_index('run')
-  waits = waits.stack()
-  waits = waits.droplevel(1)
-
-
-  pdf_by_run = _histogram_by_run(waits)
-  pdf = pdf_by_run.groupby('cut').mean()
-  pdf_CI = pdf_by_run.groupby('cut')['wait'].apply(confidence_interval)
-  cdf_by_run = pdf_by_run.groupby('run').apply(lambda x: x.cumsum())
-  cdf = cdf_by_run.groupby('cut').mean()
-  cdf_CI = cdf_by_run.groupby('cut')['wait'].apply(confidence_interval)
+  return pd.DataFrame.from_dict(results, orient = 'index')\
+    .stack()\
+    .to_frame(name = 'Metrics')
 
-  return_df = pd.DataFrame({
-    # 'pdf' : pdf.wait,
-    # 'pdf_CI' : pdf_CI,
-    'cdf' : cdf.wait,
-    'cdf_CI' : cdf_CI
-  })
-  return return_df
 
-def _histogram_by_run(waits, n_bins = 10):
-  run_group = waits.groupby('run')
-  mean_max = run_group.max().mean()
-  mean_min = run_group.min().mean()
-  bin_size = (mean_max - mean_min)/n_bins
-
-  bins = np.linspace(mean_min, mean_max, n_bins)
-
-  cuts = []
-  for i in range(1, n_bins):
-    bin = ( mean_min  + ((i - 1) * bin_size), mean_min  + (i * bin_size))
-    cut = waits[ waits.between( bin[0], bin[1], inclusive = 'left') ]
-    cut = cut.to_frame(name = 'wait')
-    cut['cut'] = [bin for _ in range(cut.shape[0])]
-    cuts.append(cut)
-  
-  cuts = pd.concat(cuts)
-  cuts_group = cuts.groupby(['run', 'cut'])
-  cuts_by_run = cuts_group.sum()
-  total_wait_per_run = cuts_by_run.groupby('run').sum()
-  pdf_by_run = cuts_by_run/ total_wait_per_run
-  #pdf = pdf_by_run.mean(level = 'cut')
-  
-  # cuts = cuts.reset_index()
-  # cuts = cuts.set_index(['run', 'bin'])
-  # cuts = cuts.sort_index()
+#distribuição dos tempos de permanência: histograma de cada run com os bins de histogram_by_run
+#indexado pelo fim de cada bin, onde a cdf (fração dos clientes da run com espera até ali) é avaliada
+def wait_dist(simulation_obj : Simulation, bins = 10, binning = 'fixed'):
+  if(simulation_obj.stats is not None):
+    raise ValueError('wait_dist precisa dos tempos de espera, que o modo streaming não guarda')
+  summary = simulation_obj.summary
+  edges, pdf_by_run, cdf_by_run = histogram_by_run(summary.waits, summary.service_runs, bins = bins, binning = binning)
 
-  # mean_delay_by_cut_and_bin = cuts.mean(level = ['run','bin'])
+  return_df = pd.DataFrame({
+    'bin_start' : edges[:-1],
+    'pdf' : pdf_by_run.mean(axis = 0),
+    'pdf_CI' : _column_confidence_intervals(pdf_by_run),
+    'cdf' : cdf_by_run.mean(axis = 0),
+    'cdf_CI' : _column_confidence_intervals(cdf_by_run)
+  }, index = pd.Index(edges[1:], name = 'wait'))
+  return return_df
 
-  # print(mean_delay_by_cut_and_bin.mean(level = 'bin'))
-  # mean_delay_by_cut_and_bin.to_clipboard()
-  return pdf_by_run
-    
+#limites dos bins de histogram_by_run
+#'fixed': largura fixa entre as médias, entre as runs, do menor e do maior valor
+#'log': o mesmo intervalo em escala logarítmica (valores positivos)
+#'quantile': quantis dos valores de todas as runs, com a mesma quantidade de valores por bin
+def histogram_edges(values, runs, bins = 10, binning = 'fixed'):
+  assert binning in ['fixed', 'log', 'quantile']
+  if(binning == 'quantile'):
+    return np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+  order = np.argsort(runs, kind = 'stable')
+  values, runs = np.asarray(values)[order], np.asarray(runs)[order]
+  _, starts = np.unique(runs, return_index = True)
+  run_min = np.minimum.reduceat(values, starts).mean()
+  run_max = np.maximum.reduceat(values, starts).mean()
+  if(binning == 'log'):
+    return np.geomspace(run_min, run_max, bins + 1)
+  return np.linspace(run_min, run_max, bins + 1)
+
+#histograma dos valores de cada run em uma passada: o bin de cada valor vem de uma busca binária
+#nos limites e as contagens de todos os pares (run, bin) de um único bincount
+#bins é a quantidade de bins (com os limites de histogram_edges) ou o array dos limites
+#retorna os limites e as matrizes (runs x bins) de pdf (fração dos valores da run em cada bin) e
+#cdf (fração dos valores da run até o fim de cada bin, incluindo os abaixo do primeiro limite)
+def histogram_by_run(values, runs, bins = 10, binning = 'fixed'):
+  values = np.asarray(values, dtype = np.float64)
+  edges = histogram_edges(values, runs, bins, binning) if np.ndim(bins) == 0 else np.asarray(bins, dtype = np.float64)
+  n_bins = len(edges) - 1
+  run_ids, run_index = np.unique(runs, return_inverse = True)
+  totals = np.bincount(run_index, minlength = len(run_ids))[:, None]
+
+  #bins fechados à esquerda; o último também inclui o limite direito
+  bin_index = np.searchsorted(edges, values, side = 'right') - 1
+  bin_index[values == edges[-1]] = n_bins - 1
+  inside = (bin_index >= 0) & (bin_index < n_bins)
+  counts = np.bincount(run_index[inside] * n_bins + bin_index[inside], minlength = len(run_ids) * n_bins)
+  pdf_by_run = counts.reshape(len(run_ids), n_bins) / totals
+  below = np.bincount(run_index[bin_index < 0], minlength = len(run_ids))[:, None] / totals
+  cdf_by_run = below + pdf_by_run.cumsum(axis = 1)
+  return edges, pdf_by_run, cdf_by_run
+
+#intervalos de confiança de confidence_interval para cada coluna de uma matriz (amostras x colunas)
+def _column_confidence_intervals(samples, confidence_rate = 1.95):
+  x = samples.mean(axis = 0)
+  n = samples.shape[0]
+  with np.errstate(invalid = 'ignore', divide = 'ignore'):
+    s = samples.std(axis = 0, ddof = 1) if n > 1 else np.full(samples.shape[1], np.nan)
+  z = confidence_rate
+  return list(zip(x - z*(s/ math.sqrt(n)), x + z*(s/ math.sqrt(n))))
 
+#distribuição do número de clientes a partir da matriz de ocupação (runs x estados) de RunSummary
+#estados não visitados por uma run contam com tempo zero; trim corta os estados a partir do menor
+#dos maiores estados das runs
 def customers_dist(simulation_obj : 'Simulation', trim = False):
-  simulation = simulation_obj.data
+  if(simulation_obj.stats is not None):
+    return _streaming_customers_dist(simulation_obj.stats, trim)
+  summary = simulation_obj.summary
+  occupancy = summary.occupancy
   if(trim):
-    max_states = simulation.groupby('run')['N'].max()
-    min_of_max = min(max_states)
-    simulation = simulation[simulation['N'] < min_of_max]
-
-  def pdf():
-
-    total_state_time_per_run = simulation.groupby(['run', 'N'])['holding'].sum()
-    total_time_per_run = simulation.groupby(['run'])['holding'].sum()
-    pdf_per_run = total_state_time_per_run/total_time_per_run
-    ci_df = pdf_per_run.groupby('N').apply(confidence_interval).to_frame(name = 'pdf_CI')
-    # remove valores (nan, nan) resultantes de amostras únicas
-    ci_df = ci_df[~ci_df.pdf_CI.apply( lambda x: np.isnan(x[0]) & np.isnan(x[1]))]
-    
-    _pdf = pdf_per_run.groupby('N').mean()
-    # print(pdf_per_run)
-    # _pdf = pdf_per_run.mean(level='N')
-    _pdf = _pdf.rename('pdf')
-    pdf_df = pd.merge(left = _pdf, right = ci_df, left_on='N', right_on='N')
-    return pdf_df
-  
-  def cdf():
-    max_state = simulation.N.max()
-    total_state_time_per_run = simulation.groupby(['run', 'N'])['holding'].sum()
-    total_time_per_run = simulation.groupby(['run'])['holding'].sum()
-    pdf_per_run = total_state_time_per_run/total_time_per_run
-    cdf_per_run = pdf_per_run.groupby('run').apply(
-       lambda x: x.cumsum(axis = 0)
-    )
-
-    def fill_max(x):
-      max_range = pd.Series({(x.idxmax()[0],i): 1.0 for i in range(x.idxmax()[1] + 1, max_state + 1)}, dtype=np.float64)
-      x = pd.concat([x,max_range])
-      return x
-
-    cdf_per_run = cdf_per_run.groupby('run').apply(fill_max)
-    #print(cdf_per_run)
-    _cdf = cdf_per_run.groupby('N').mean()
-    _cdf = _cdf.rename('cdf')
-
-    ci_df = cdf_per_run.groupby('N').apply(confidence_interval).to_frame(name = 'cdf_CI')
-    #remove valores (nan, nan) resultantes de amostras únicas
-    ci_df = ci_df[~ci_df.cdf_CI.apply( lambda x: np.isnan(x[0]) & np.isnan(x[1]))]
-    
-    cdf_df = pd.merge(left = _cdf, right = ci_df, left_on='N', right_on='N')
-    return cdf_df
-  
-  _pdf = pdf()
-  _cdf = cdf()
-  result = pd.merge(left = _pdf, right = _cdf, left_on='N', right_on='N')
-  result.sort_index(inplace=True)
-  return result
-
+    min_of_max = summary.max_state.min()
+    occupancy = occupancy[:, :min_of_max]
+
+  pdf_per_run = occupancy / occupancy.sum(axis = 1, keepdims = True)
+  cdf_per_run = pdf_per_run.cumsum(axis = 1)
+
+  result = pd.DataFrame({
+    'pdf' : pdf_per_run.mean(axis = 0),
+    'pdf_CI' : _column_confidence_intervals(pdf_per_run),
+    'cdf' : cdf_per_run.mean(axis = 0),
+    'cdf_CI' : _column_confidence_intervals(cdf_per_run)
+  }, index = pd.RangeIndex(occupancy.shape[1], name = 'N'))
+  # remove valores (nan, nan) resultantes de amostras únicas
+  single = result.pdf_CI.apply(lambda x: np.isnan(x[0]) & np.isnan(x[1])) | result.cdf_CI.apply(lambda x: np.isnan(x[0]) & np.isnan(x[1]))
+  return result[~single]
+
+#no modo streaming só há o histograma de ocupação somado entre as runs (StreamingStats.occupancy_pmf),
+#então a distribuição não tem intervalos de confiança
+def _streaming_customers_dist(stats, trim):
+  if(trim):
+    raise ValueError('trim precisa do maior estado de cada run, que o modo streaming não guarda')
+  pdf = stats.occupancy_pmf()
+  no_ci = [(np.nan, np.nan)] * pdf.shape[0]
+  return pd.DataFrame({
+    'pdf' : pdf,
+    'pdf_CI' : no_ci,
+    'cdf' : pdf.cumsum(),
+    'cdf_CI' : no_ci
+  }, index = pd.RangeIndex(pdf.shape[0], name = 'N'))
@@ -6,19 +6,92 @@ from datetime import datetime
 import abc
 import analytical as an
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pandas.core.frame import DataFrame
+from event_calendar import EventCalendar
+from ledger import Ledger, CustomerLog, ARRIVAL, SERVICE
+from variates import as_seed_sequence, run_seeds, run_generators, VariateSource
+from streaming import StreamingStats
+from simulated_metrics import confidence_interval, run_samples, RunSummary
 
 from plot_metrics import plot_md1_customers_dist, plot_mm1_customers_dist, plot_md1_wait_dist, plot_mm1_wait_dist
 
 
 #classe abstrata das simulações
 class Simulation:
-  def __init__(self, lamda, mu, data : DataFrame, service_durations: DataFrame):
+  #modelo da cadeia analítica ('mm1', 'md1' ou 'mmk') e número de servidores
+  model = None
+  k = 1
+  #massa máxima da distribuição estacionária descartada ao truncar a cadeia analítica
+  epsilon = 1e-9
+
+  def __init__(self, lamda, mu, data : 'DataFrame | Ledger | StreamingStats', service_durations: DataFrame):
     self.lamda = lamda
     self.mu = mu
-    self.data = data
+    self.ledger = data if isinstance(data, Ledger) else None
+    #tabela de clientes (ledger.CustomerLog), quando a simulação foi feita com customers = True
+    self.customers = self.ledger.customers if self.ledger is not None else None
+    #no modo streaming não há ledger, só os acumuladores das métricas
+    self.stats = data if isinstance(data, StreamingStats) else None
+    self._data = data if isinstance(data, DataFrame) else None
     self.service_durations = service_durations
     self.rho = lamda/mu
+    self._summary = None
+
+  #o DataFrame é montado sob demanda sobre as colunas do ledger, sem cópia
+  @property
+  def data(self) -> DataFrame:
+    if(self._data is None and self.ledger is not None):
+      self._data = self.ledger.to_frame()
+    return self._data
+
+  @data.setter
+  def data(self, data : DataFrame):
+    self._data = data
+    self._summary = None
+
+  #resumo por run (ver simulated_metrics.RunSummary), calculado uma vez e usado por todas as métricas
+  #no modo streaming não há eventos para resumir: as métricas vêm dos acumuladores em self.stats
+  @property
+  def summary(self):
+    if(self.stats is not None):
+      raise ValueError('simulação em modo streaming não guarda os eventos; use sim.stats')
+    if(self._summary is None):
+      self._summary = RunSummary(self.data, self.customers, servers = self.k)
+    return self._summary
+
+  #maior número de clientes observado
+  @property
+  def max_state(self):
+    if(self.stats is not None):
+      return self.stats.max_state
+    return int(self.summary.max_state.max())
+
+  #modelo analítico da fila ('mm1', 'mmk' ou 'md1'); None quando não há forma fechada
+  def _analytical_model(self):
+    if(self.model is None):
+      raise ValueError(f'{type(self).__name__} não tem modelo analítico para esta fila')
+    return self.model
+
+  #distribuição estacionária truncada no menor número de estados com cauda abaixo de epsilon
+  #cadeias instáveis não têm cauda pequena: trunca no maior estado observado
+  def _stationary_distribution(self):
+    model = self._analytical_model()
+    if(self.lamda >= self.k * self.mu):
+      return an.stationary_distribution(model, self.lamda, self.mu, self.k, capacity= self.max_state + 1)
+    pi, _ = an.truncated_stationary_distribution(model, self.lamda, self.mu, self.k, epsilon= self.epsilon)
+    return pi
+
+  #distribuição transiente P(N(t) = n) nos instantes t, partindo do sistema vazio como as runs
+  #simuladas; um array (len(t), estados). só para as filas markovianas
+  def transient_pdf(self, t):
+    return an.transient_distribution(self._analytical_model(), self.lamda, self.mu, t, k = self.k, epsilon = self.epsilon)
+
+  #massa descartada pelo truncamento de pdf (nan se a fila é instável)
+  @property
+  def truncation_error(self):
+    return an.truncation_capacity(self._analytical_model(), self.lamda, self.mu, self.k, epsilon= self.epsilon)[1]
   
   @abc.abstractmethod
   def __repr__(self) -> str:
@@ -43,6 +116,11 @@ class Simulation:
   def average_customers(self):
     pass
 
+  #tempo médio de espera na fila, antes do serviço
+  @property
+  def average_delay(self):
+    return self.average_wait - 1/self.mu
+
   @property
   @abc.abstractmethod
   def utilization(self):
@@ -58,6 +136,7 @@ class Simulation:
   
 #classe Simulação MM1
 class MM1Simulation(Simulation):
+  model = 'mm1'
 
   def __init__(self, lamda, mu, data, service_durations):
     super().__init__(lamda, mu, data, service_durations)
@@ -70,8 +149,7 @@ class MM1Simulation(Simulation):
 
   @property
   def pdf(self):
-    P = an.mm1_markov_chain(self.lamda, self.mu, capacity= self.data.N.max())
-    pi = an.ctmc_stationary_distribution(P)
+    pi = self._stationary_distribution()
     return pi
 
   @property
@@ -108,6 +186,7 @@ class MM1Simulation(Simulation):
 
 #classe Simulação MD1
 class MD1Simulation(Simulation):
+  model = 'md1'
   def __init__(self, lamda, mu, data, service_durations):
     self.D = 1/mu
     super().__init__(lamda, mu, data, service_durations)
@@ -119,8 +198,7 @@ class MD1Simulation(Simulation):
   
   @property
   def pdf(self):
-    P = an.md1_markov_chain(self.lamda, self.mu, capacity= self.data.N.max())
-    pi = an.dtmc_stationary_distribution(P)
+    pi = self._stationary_distribution()
     return pi
   @property
   def average_wait(self):
@@ -153,99 +231,387 @@ class MD1Simulation(Simulation):
     return
 
 # simula uma única fila mm1 ou md1, baseado no parametro kind
-def m_queue(lamda, mu, max_time = 1000, max_events = 1000, kind = 'm'):
+# registra os eventos em ledger (um novo Ledger se None) com o número da run
+# seed define os fluxos de chegadas e serviços da run (ver variates.VariateSource)
+def m_queue(lamda, mu, max_time = 1000, max_events = 1000, kind = 'm', ledger = None, run = 0, seed = None):
   assert kind in ['m','d']
-  wait_function = lambda x: np.random.exponential(1/x) if kind == 'm' else 1/mu
+  variates = VariateSource(lamda, mu, kind = kind, seed = seed)
+  next_interarrival, next_service = variates.interarrival, variates.service
   time = 0
   nevents = 0
-  ledger = []
+  if(ledger is None):
+    ledger = Ledger()
   #fila de eventos, arrival @ t = 0
-  equeue = [{
-    'type' : 'a',
-    'time' : time
-    }]
+  equeue = EventCalendar()
+  equeue.schedule(ARRIVAL, time)
 
-  
   def schedule_service():
-    service_duration = wait_function(mu)
-    service_time = time + service_duration
-    equeue.append({
-      'type' : 's',
-      'time' : service_time,
-      'duration' : service_duration
-      })
+    service_duration = next_service()
+    equeue.schedule(SERVICE, time + service_duration, service_duration)
   def schedule_arrival():
-    equeue.append({
-      'type' : 'a',
-      'time' : time +  np.random.exponential(1/lamda),
-      })
-    
+    equeue.schedule(ARRIVAL, time + next_interarrival())
+
+  #tabela de clientes (ver ledger.CustomerLog): chegadas dos clientes esperando, em ordem FIFO,
+  #e (chegada, início) do cliente em serviço
+  customers = ledger.customers
+  waiting = deque()
+  in_service = None
 
   #variavel aleatória que representa o no de pessoas na fila
   N = 0
   while(nevents < max_events and time < max_time):
     nevents += 1
-    event = equeue.pop(0)
-    time, etype = event['time'] , event['type']
+    time, _, etype, duration = equeue.pop()
 
-    if(etype == 'a'):
-   
+    if(etype == ARRIVAL):
       N += 1
+      if(customers is not None):
+        waiting.append(time)
       if(N == 1):
         schedule_service()
+        if(customers is not None):
+          in_service = (waiting.popleft(), time)
       schedule_arrival()
-      equeue = sorted(equeue, key = lambda x : x['time'])
     else:
       N -= 1
+      if(customers is not None):
+        customers.append(run, in_service[0], in_service[1], time)
       if(N > 0):
         schedule_service()
-        equeue = sorted(equeue, key = lambda x : x['time'])
-    
-    event['N'] = N
-    ledger.append(event)
+        if(customers is not None):
+          in_service = (waiting.popleft(), time)
+
+    ledger.append(etype, time, duration, N, run)
 
   return ledger
 
-# simula multiplas filas mm1 ou md1
-def queue_sim(lamda, mu, max_time = 1000, max_events = 1000, runs = 10, kind = 'm', export = False):
+#versão dos motores de simulação, parte da chave do cache: incremente quando uma mudança
+#alterar os eventos gerados para a mesma semente
+ENGINE_VERSION = 2
+
+#limite de elementos por array (runs x eventos) no motor em lote
+BATCH_MAX_ELEMENTS = 2**24
+
+#gera os instantes de chegada de cada fila em um array (filas x n), com a primeira chegada em t = 0
+#cada linha usa o seu próprio gerador de chegadas
+#no máximo max_events chegadas participam dos primeiros max_events eventos
+def _lindley_arrivals(lamda, arrival_rngs, max_time, max_events):
+  n = int(min(max_events, math.ceil(lamda * max_time * 1.1) + 16))
+  interarrivals = np.stack([rng.exponential(1/lamda, size = n) for rng in arrival_rngs])
+  arrivals = np.zeros(interarrivals.shape)
+  np.cumsum(interarrivals[:, :-1], axis = 1, out = arrivals[:, 1:])
+  #gera mais chegadas até todas as filas passarem de max_time ou atingirem max_events
+  while(n < max_events and arrivals[:, -1].min() < max_time):
+    extra = int(min(max_events - n, n))
+    interarrivals = np.stack([rng.exponential(1/lamda, size = extra) for rng in arrival_rngs])
+    arrivals = np.hstack((arrivals, arrivals[:, -1:] + np.cumsum(interarrivals, axis = 1)))
+    n += extra
+  return arrivals
+
+# chegadas (ver _lindley_arrivals) e serviços de cada fila, uma linha por semente
+# os serviços são sorteados na ordem dos clientes, como no laço de eventos com disciplina FIFO
+def _draw_customers(lamda, mu, seeds, max_time, max_events, kind):
+  arrival_rngs, service_rngs = zip(*[run_generators(seed) for seed in seeds])
+  arrivals = _lindley_arrivals(lamda, arrival_rngs, max_time, max_events)
+  runs, n = arrivals.shape
+  if(kind == 'm'):
+    services = np.stack([rng.exponential(1/mu, size = n) for rng in service_rngs])
+  else:
+    services = np.full((runs, n), 1/mu)
+  return arrivals, services
+
+# intercala as chegadas e partidas de cada fila (linha) em ordem de tempo
+# retorna os eventos, quantos eventos cada fila registra com o mesmo critério de parada do laço de
+# eventos e, em cada evento de partida, o índice do cliente que partiu (-1 nas chegadas)
+def _merge_events(arrivals, services, departures, max_time, max_events):
+  runs, n = arrivals.shape
+  times = np.hstack((arrivals, departures))
+  order = np.argsort(times, axis = 1, kind = 'stable')
+  times = np.take_along_axis(times, order, axis = 1)
+  is_service = order >= n
+  durations = np.take_along_axis(np.hstack((np.full((runs, n), np.nan), services)), order, axis = 1)
+
+  #o primeiro evento com time >= max_time é registrado
+  nevents = np.minimum(min(max_events, 2 * n), (times < max_time).sum(axis = 1) + 1).astype(np.int64)
+  return times, is_service, durations, nevents, np.where(is_service, order - n, -1)
+
+# a partida do cliente i é D_i = max(D_{i-1}, A_i) + S_i (recursão de Lindley), que em forma
+# fechada fica D = C + max acumulado de (A - C + S), onde C é a soma acumulada dos serviços
+# retorna os eventos de _merge_events e as colunas (chegada, início, partida, servidor) dos clientes
+def _lindley_events(lamda, mu, seeds, max_time, max_events, kind):
+  arrivals, services = _draw_customers(lamda, mu, seeds, max_time, max_events, kind)
+  cum_services = np.cumsum(services, axis = 1)
+  departures = cum_services + np.maximum.accumulate(arrivals - cum_services + services, axis = 1)
+  starts = np.maximum(arrivals, np.hstack((np.full((arrivals.shape[0], 1), -np.inf), departures[:, :-1])))
+  return _merge_events(arrivals, services, departures, max_time, max_events), (arrivals, starts, departures, 0)
+
+# registra em ledger os eventos de filas simuladas como arrays (uma linha por run em run_ids)
+# e, se o ledger guarda a tabela de clientes, os clientes que partiram, na ordem das partidas
+def _record_events(ledger, run_ids, events, customers):
+  times, is_service, durations, nevents, customer = events
+  N = np.cumsum(np.where(is_service, -1, 1), axis = 1)
+  #mantém os eventos registrados de cada run
+  keep = np.arange(times.shape[1]) < nevents[:, None]
+  ledger.extend(is_service[keep], times[keep], durations[keep], N[keep], np.repeat(run_ids, nevents))
+  if(ledger.customers is not None):
+    rows, index = np.nonzero(keep & is_service)[0], customer[keep & is_service]
+    arrival, start, departure, server = customers
+    ledger.customers.extend(run_ids[rows], arrival[rows, index], start[rows, index], departure[rows, index],
+      server[rows, index] if np.ndim(server) else server)
+
+# simula uma única fila mm1 ou md1 FIFO de forma vetorizada (recursão de Lindley)
+# registra os eventos em ledger (um novo Ledger se None) com o número da run
+def lindley_queue(lamda, mu, max_time = 1000, max_events = 1000, kind = 'm', ledger = None, run = 0, seed = None):
   assert kind in ['m','d']
+  if(ledger is None):
+    ledger = Ledger()
+  _record_events(ledger, np.array([run]), *_lindley_events(lamda, mu, [seed], max_time, max_events, kind))
+  return ledger
 
-  ledger_df = []
-
-  for i in range(runs):
-      ledger = m_queue(lamda, mu, max_time = max_time, max_events = max_events, kind = kind)
-      ledger = pd.DataFrame(ledger)
-      ledger['run'] = i
-      ledger['holding'] = ledger.time.shift(-1) - ledger.time
-      ledger_df.append(ledger)
-
-  ledger_df = pd.concat(ledger_df)
-
-  #remove a última amostra, pois não é possível calcular o tempo do estado
-  ledger_df.dropna(how = 'any', axis = 0, subset = ['holding'], inplace = True)
-  ledger_df.reset_index(inplace=True, drop=True)
+# motor em lote comum: simula as filas de todas as sementes em blocos de runs e registra os eventos
+# das runs first_run, first_run + 1, ... em um único Ledger (um novo se None)
+# events_function(seeds) simula as filas de um bloco de sementes como arrays e retorna
+# (eventos de _merge_events, colunas dos clientes), como _lindley_events
+def _simulate_batch(events_function, lamda, max_time, max_events, ledger = None, first_run = 0, seeds = None):
+  if(seeds is None):
+    seeds = run_seeds(None, 10)
+  runs = len(seeds)
+  n = int(min(max_events, math.ceil(lamda * max_time * 1.1) + 16))
+  chunk = max(1, int(BATCH_MAX_ELEMENTS // (2 * n)))
+  if(ledger is None):
+    ledger = Ledger()
+  #no máximo min(2n, max_events) eventos e n clientes por run: aloca tudo de uma vez, também no
+  #ledger recebido de simulate_runs
+  ledger.reserve(runs * min(2 * n, max_events), customers = runs * n)
+
+  for start in range(0, runs, chunk):
+    chunk_seeds = seeds[start:start + chunk]
+    run_ids = np.arange(first_run + start, first_run + start + len(chunk_seeds))
+    _record_events(ledger, run_ids, *events_function(chunk_seeds))
 
-  if(kind == 'm'):
-    service_df = ledger_df['duration'].rename({
-      'duration' : 'service_duration'
-    })
-    service_df.dropna(inplace=True)
-  else:
-    service_df = pd.Series({index : 1/mu for index in ledger_df[ledger_df.type == 's'].index},\
-      name = 'duration')
+  return ledger
 
-  ledger_df.drop(columns=['duration'], inplace= True)
+# simula todas as filas mm1 ou md1 FIFO juntas como arrays (runs x eventos), uma por semente,
+# e registra os eventos das runs first_run, first_run + 1, ... em um único Ledger
+def lindley_batch(lamda, mu, max_time = 1000, max_events = 1000, kind = 'm', ledger = None, first_run = 0, seeds = None):
+  assert kind in ['m','d']
+  return _simulate_batch(lambda seeds: _lindley_events(lamda, mu, seeds, max_time, max_events, kind),
+    lamda, max_time, max_events, ledger, first_run, seeds)
+#simula todas as runs em uma chamada (ver _simulate_runs)
+lindley_batch.batched = True
+
+# simula as runs first_run, first_run + 1, ... (uma por semente) com engine_function em ledger
+# engine_function simula uma run por chamada, exceto os motores em lote (batched = True, como
+# lindley_batch), que simulam todas juntas
+def _simulate_runs(engine_function, ledger, first_run, seeds, **params):
+  if(getattr(engine_function, 'batched', False)):
+    engine_function(ledger = ledger, first_run = first_run, seeds = seeds, **params)
+    return ledger
+  for i, seed in enumerate(seeds):
+    engine_function(ledger = ledger, run = first_run + i, seed = seed, **params)
+  return ledger
 
-  
+# tarefa de um worker: devolve os arrays compactos do ledger (e da tabela de clientes) em vez de
+# DataFrames, ou os acumuladores no modo streaming
+def _simulate_runs_worker(engine_function, first_run, seeds, params, stream, customers = False):
+  if(stream):
+    return _simulate_runs(engine_function, StreamingStats(servers = params.get('k', 1)), first_run, seeds, **params)
+  ledger = _simulate_runs(engine_function, Ledger(customers = customers), first_run, seeds, **params)
+  return ledger.arrays(), ledger.customers.arrays() if customers else None
+
+# simula runs replicações independentes com engine_function e junta todas em um Ledger
+# a run i usa a semente i derivada de seed, então o resultado é o mesmo para qualquer n_jobs
+# n_jobs > 1 (ou -1 para todos os núcleos) distribui as runs em um ProcessPoolExecutor;
+# também é possível passar um executor já criado
+# stream = True troca o Ledger por StreamingStats, que acumula as métricas sem guardar os eventos
+# first_run permite continuar uma simulação com as runs seguintes
+# customers = True também registra a tabela de clientes em ledger.customers (ver ledger.CustomerLog)
+def simulate_runs(engine_function, runs, seed = None, n_jobs = 1, executor = None, stream = False, first_run = 0,
+  customers = False, **params):
+  assert not (stream and customers)
+  seeds = run_seeds(seed, runs, first_run = first_run)
+  if(n_jobs == -1):
+    n_jobs = os.cpu_count()
+  if(executor is None and n_jobs <= 1):
+    return _simulate_runs(engine_function, StreamingStats(servers = params.get('k', 1)) if stream else Ledger(customers = customers), first_run, seeds, **params)
+
+  own_executor = executor is None
+  if(own_executor):
+    executor = ProcessPoolExecutor(max_workers = n_jobs)
+  #blocos contíguos de runs, alguns por worker para equilibrar a carga
+  chunk = max(1, math.ceil(runs / (4 * max(n_jobs, 1))))
+  starts = range(0, runs, chunk)
+  try:
+    results = executor.map(_simulate_runs_worker, [engine_function] * len(starts), [first_run + start for start in starts],
+      [seeds[start:start + chunk] for start in starts], [params] * len(starts), [stream] * len(starts), [customers] * len(starts))
+    ledger = StreamingStats(servers = params.get('k', 1)) if stream else Ledger(customers = customers)
+    for result in results:
+      if(stream):
+        ledger.merge(result)
+      else:
+        ledger.extend(*result[0])
+        if(customers):
+          ledger.customers.extend(*result[1])
+  finally:
+    if(own_executor):
+      executor.shutdown()
+  return ledger
 
-  if(kind == 'm'):
-    sim = MM1Simulation(lamda = lamda, mu = mu, data = ledger_df, service_durations = service_df)
-  else:
-    sim = MD1Simulation(lamda = lamda, mu = mu, data = ledger_df, service_durations = service_df)
+# meias-larguras dos intervalos de confiança das métricas por run escolhidas
+def _half_widths(ledger, precision_metrics, servers = 1):
+  samples = ledger.run_samples() if isinstance(ledger, StreamingStats) else run_samples(ledger.to_frame(), servers)
+  half_widths = {}
+  for metric in precision_metrics:
+    values = pd.Series(samples[metric])
+    lower, upper = confidence_interval(values)
+    half_widths[metric] = ((upper - lower) / 2, abs(values.mean()))
+  return half_widths
+
+# simula blocos de runs até a meia-largura do intervalo de confiança de cada métrica em precision_metrics
+# ('wait', 'customers', 'utilization') ficar abaixo de target_precision, relativa à média se
+# relative = True ou absoluta caso contrário, ou até max_runs runs
+# o número de runs de cada novo bloco é estimado pela meia-largura atual (que cai com 1/sqrt(runs))
+# retorna o ledger e um relatório com runs, eventos e meias-larguras finais
+def simulate_to_precision(engine_function, runs, target_precision, precision_metrics = ('wait', 'customers', 'utilization'),
+  relative = True, max_runs = 100000, seed = None, n_jobs = 1, executor = None, stream = False, customers = False, **params):
+  ledger = simulate_runs(engine_function, runs, seed = seed, n_jobs = n_jobs, executor = executor, stream = stream,
+    customers = customers, **params)
+  total_runs = runs
+  while(True):
+    half_widths = _half_widths(ledger, precision_metrics, params.get('k', 1))
+    ratios = [half_width / (target_precision * (mean if relative else 1)) for half_width, mean in half_widths.values()]
+    converged = all(ratio <= 1 for ratio in ratios)
+    if(converged or total_runs >= max_runs):
+      break
+    needed = math.ceil(total_runs * max(ratios) ** 2 * 1.1) if np.isfinite(max(ratios)) else 2 * total_runs
+    new_runs = int(min(max(needed - total_runs, runs), max_runs - total_runs))
+    block = simulate_runs(engine_function, new_runs, seed = seed, n_jobs = n_jobs, executor = executor, stream = stream,
+      first_run = total_runs, customers = customers, **params)
+    ledger.merge(block)
+    total_runs += new_runs
+
+  report = {
+    'runs' : total_runs,
+    'events' : ledger.events if stream else len(ledger),
+    'converged' : converged,
+    'half_widths' : {metric : half_width for metric, (half_width, _) in half_widths.items()}
+  }
+  return ledger, report
+
+# chave de cache dos parâmetros key_params de uma simulação, junto com a versão dos motores
+def simulation_key(cache, key_params):
+  return cache.key(engine_version = ENGINE_VERSION, **key_params)
+
+# busca a simulação com os parâmetros key_params em cache (um cache.SimulationCache) ou roda
+# simulate(), que retorna (ledger, relatório de precisão), e guarda o resultado
+# só guarda quando a semente foi dada, pois sem ela a simulação não é reproduzível
+# retorna o ledger, o relatório e a chave
+def _simulate_cached(cache, key_params, simulate, stream):
+  if(cache is None):
+    return (*simulate(), None)
+  key = simulation_key(cache, key_params)
+  entry = cache.load(key)
+  if(entry is not None):
+    arrays, meta = entry
+    if(stream):
+      ledger = StreamingStats.from_arrays(arrays)
+    else:
+      ledger = Ledger.from_arrays(*(arrays[column] for column in Ledger.columns))
+      if('customer_run' in arrays):
+        ledger.customers = CustomerLog.from_arrays(*(arrays[f'customer_{column}'] for column in CustomerLog.columns))
+    return ledger, meta['precision'], key
+
+  ledger, precision = simulate()
+  if(key_params['seed'] is not None):
+    if(stream):
+      arrays = ledger.to_arrays()
+    else:
+      arrays = dict(zip(Ledger.columns, ledger.arrays()))
+      if(ledger.customers is not None):
+        arrays.update(zip((f'customer_{column}' for column in CustomerLog.columns), ledger.customers.arrays()))
+    cache.store(key, arrays, {'precision' : precision})
+  return ledger, precision, key
+
+# parâmetros que identificam uma simulação de queue_sim no cache
+# model distingue as funções que simulam (queue_sim deste módulo ou mmk.queue_sim) e k, o número de
+# servidores, só entra na chave dos modelos com k servidores
+# os critérios de parada só identificam a simulação quando ela roda até uma precisão
+def _queue_sim_key_params(lamda, mu, max_time, max_events, runs, kind, engine, seed, stream, target_precision, customers,
+  precision_kwargs, model = 'queue_sim', k = None):
+  key_params = dict(model = model, lamda = lamda, mu = mu, max_time = max_time, max_events = max_events, runs = runs,
+    kind = kind, engine = engine, stream = stream, target_precision = target_precision, seed = seed, customers = customers)
+  if(k is not None):
+    key_params['k'] = k
+  if(target_precision is not None):
+    key_params.update(precision_kwargs)
+  return key_params
+
+# chave de cache da simulação que queue_sim faria com esses argumentos, para cache.invalidate(queue_sim_key(cache, ...))
+def queue_sim_key(cache, lamda, mu, max_time = 1000, max_events = 1000, runs = 10, kind = 'm', engine = 'events',
+  seed = None, stream = False, target_precision = None, customers = False,
+  precision_metrics = ('wait', 'customers', 'utilization'), relative = True, max_runs = 100000, model = 'queue_sim', k = None):
+  precision_kwargs = dict(precision_metrics = precision_metrics, relative = relative, max_runs = max_runs)
+  return simulation_key(cache, _queue_sim_key_params(lamda, mu, max_time, max_events, runs, kind, engine, seed, stream,
+    target_precision, customers, precision_kwargs, model, k))
+
+# corpo comum de queue_sim e mmk.queue_sim: roda as runs com engine_function (ou as busca em cache),
+# uma quantidade fixa ou até target_precision, e monta a simulação com
+# make_simulation(ledger, service_durations); k != None é passado ao motor e entra na chave do cache
+def _queue_sim(make_simulation, engine_function, lamda, mu, max_time, max_events, runs, kind, export, engine, seed,
+  n_jobs, executor, stream, target_precision, cache, customers, precision_kwargs, model = 'queue_sim', k = None):
+  key_params = _queue_sim_key_params(lamda, mu, max_time, max_events, runs, kind, engine, seed, stream, target_precision,
+    customers, precision_kwargs, model, k)
+  seed = as_seed_sequence(seed)
+  params = dict(lamda = lamda, mu = mu, max_time = max_time, max_events = max_events, kind = kind)
+  if(k is not None):
+    params['k'] = k
+
+  def simulate():
+    if(target_precision is None):
+      return simulate_runs(engine_function, runs, seed = seed, n_jobs = n_jobs, executor = executor, stream = stream,
+        customers = customers, **params), None
+    return simulate_to_precision(engine_function, runs, target_precision, seed = seed, n_jobs = n_jobs,
+      executor = executor, stream = stream, customers = customers, **precision_kwargs, **params)
+
+  ledger, precision, cache_key = _simulate_cached(cache, key_params, simulate, stream)
+  service_df = None if stream else ledger.service_durations()
+
+  sim = make_simulation(ledger, service_df)
+  #entropia da semente raiz, para reproduzir a simulação
+  sim.seed = seed.entropy
+  sim.precision = precision
+  sim.cache_key = cache_key
 
   if (export):
     sim.export_to_csv()
   return sim
 
-
-
+# simula multiplas filas mm1 ou md1
+# engine = 'events' usa o laço de eventos, engine = 'vectorized' usa a recursão de Lindley
+# fila a fila e engine = 'batched' simula todas as runs juntas como arrays 2-D
+# seed é a semente raiz das runs; n_jobs/executor distribuem as runs entre processos
+# stream = True não guarda o ledger: as métricas são acumuladas durante o laço de eventos
+# (sim.stats) e metrics(sim) retorna a mesma tabela, com memória constante no número de eventos
+# target_precision != None continua adicionando runs até os intervalos de confiança atingirem a precisão
+# (ver simulate_to_precision, que recebe precision_metrics, relative e max_runs); o relatório com runs
+# e eventos usados fica em sim.precision
+# cache (um cache.SimulationCache) devolve a simulação salva quando parâmetros, semente e versão dos
+# motores coincidem; sim.cache_key (ou queue_sim_key) é a chave da entrada, para cache.invalidate(sim.cache_key)
+# customers = True guarda também a tabela de clientes (chegada, início do serviço, partida) em
+# sim.customers, de onde saem a espera na fila (Delay) e a permanência sem casar eventos
+def queue_sim(lamda, mu, max_time = 1000, max_events = 1000, runs = 10, kind = 'm', export = False, engine = 'events',
+  seed = None, n_jobs = 1, executor = None, stream = False, target_precision = None, cache = None, customers = False,
+  precision_metrics = ('wait', 'customers', 'utilization'), relative = True, max_runs = 100000):
+  assert kind in ['m','d']
+  assert engine in ['events', 'vectorized', 'batched']
+  assert not stream or engine == 'events'
+  engine_function = {'events' : m_queue, 'vectorized' : lindley_queue, 'batched' : lindley_batch}[engine]
+
+  def make_simulation(ledger, service_df):
+    if(kind == 'm'):
+      return MM1Simulation(lamda = lamda, mu = mu, data = ledger, service_durations = service_df)
+    return MD1Simulation(lamda = lamda, mu = mu, data = ledger, service_durations = service_df)
+
+  precision_kwargs = dict(precision_metrics = precision_metrics, relative = relative, max_runs = max_runs)
+  return _queue_sim(make_simulation, engine_function, lamda, mu, max_time, max_events, runs, kind, export, engine, seed,
+    n_jobs, executor, stream, target_precision, cache, customers, precision_kwargs)
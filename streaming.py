@@ -0,0 +1,132 @@
+from collections import deque
+import numpy as np
+
+from ledger import ARRIVAL
+
+#acumuladores das métricas de uma simulação, atualizados evento a evento sem guardar o ledger
+#tem a mesma interface de escrita do Ledger (append/extend), então os motores podem usá-lo no lugar dele
+#cada evento só é contabilizado quando o próximo evento da mesma run chega (é aí que o holding
+#fica conhecido), o que descarta a última amostra de cada run como no ledger
+class StreamingStats:
+  #não guarda a tabela de clientes (ver ledger.CustomerLog)
+  customers = None
+
+  #servers é o número de servidores da fila: o tempo ocupado pondera cada estado por
+  #min(N, servers)/servers, como em simulated_metrics.RunSummary
+  def __init__(self, servers = 1):
+    self.servers = servers
+    #por run: tempo total, tempo ocupado, área sob N(t), instante da última amostra
+    #e soma/média/M2 (Welford) dos tempos de permanência
+    self.runs = []
+    self.total_time = []
+    self.busy_time = []
+    self.area = []
+    self.last_time = []
+    self.wait_count = []
+    self.wait_mean = []
+    self.wait_m2 = []
+    #histograma de ocupação: tempo total em cada estado, somado entre as runs
+    self.occupancy = np.zeros(16)
+    self.events = 0
+    self._pending = None
+    self._arrivals = deque()
+
+  def __len__(self):
+    return len(self.runs)
+
+  @property
+  def max_state(self):
+    return int(np.flatnonzero(self.occupancy).max(initial = 0))
+
+  def _open_run(self, run):
+    self.runs.append(run)
+    for column in (self.total_time, self.busy_time, self.area, self.last_time, self.wait_mean, self.wait_m2):
+      column.append(0.0)
+    self.wait_count.append(0)
+    self._arrivals.clear()
+
+  def _commit(self, etype, time, N, holding):
+    i = -1
+    self.total_time[i] += holding
+    self.area[i] += N * holding
+    if(N > 0):
+      self.busy_time[i] += holding * min(N, self.servers) / self.servers
+    self.last_time[i] = time
+    if(N >= self.occupancy.shape[0]):
+      self.occupancy = np.concatenate((self.occupancy, np.zeros(max(N + 1, 2 * self.occupancy.shape[0]) - self.occupancy.shape[0])))
+    self.occupancy[N] += holding
+
+    if(etype == ARRIVAL):
+      self._arrivals.append(time)
+    else:
+      wait = time - self._arrivals.popleft()
+      self.wait_count[i] += 1
+      delta = wait - self.wait_mean[i]
+      self.wait_mean[i] += delta / self.wait_count[i]
+      self.wait_m2[i] += delta * (wait - self.wait_mean[i])
+
+  def append(self, etype, time, duration, N, run = 0):
+    self.events += 1
+    pending = self._pending
+    if(pending is not None and pending[3] == run):
+      self._commit(pending[0], pending[1], pending[2], time - pending[1])
+    else:
+      self._open_run(run)
+    self._pending = (etype, time, N, run)
+
+  def extend(self, etype, time, duration, N, run = 0):
+    run = np.broadcast_to(run, np.shape(time))
+    for event in zip(np.asarray(etype).tolist(), np.asarray(time).tolist(), np.asarray(N).tolist(), run.tolist()):
+      self.append(event[0], event[1], None, event[2], event[3])
+
+  #junta os acumuladores de outro StreamingStats (por exemplo, de um worker)
+  def merge(self, other):
+    for column in ('runs', 'total_time', 'busy_time', 'area', 'last_time', 'wait_count', 'wait_mean', 'wait_m2'):
+      getattr(self, column).extend(getattr(other, column))
+    self.events += other.events
+    size = max(self.occupancy.shape[0], other.occupancy.shape[0])
+    occupancy = np.zeros(size)
+    occupancy[:self.occupancy.shape[0]] += self.occupancy
+    occupancy[:other.occupancy.shape[0]] += other.occupancy
+    self.occupancy = occupancy
+    return self
+
+  #acumuladores como arrays, para salvar em disco
+  def to_arrays(self):
+    arrays = {column : np.array(getattr(self, column)) for column in
+      ('runs', 'total_time', 'busy_time', 'area', 'last_time', 'wait_count', 'wait_mean', 'wait_m2')}
+    arrays['occupancy'] = self.occupancy
+    arrays['events'] = np.array(self.events)
+    arrays['servers'] = np.array(self.servers)
+    return arrays
+
+  @classmethod
+  def from_arrays(cls, arrays):
+    stats = cls(servers = int(arrays['servers']))
+    for column in ('runs', 'total_time', 'busy_time', 'area', 'last_time', 'wait_count', 'wait_mean', 'wait_m2'):
+      setattr(stats, column, arrays[column].tolist())
+    stats.occupancy = np.array(arrays['occupancy'], dtype = np.float64)
+    stats.events = int(arrays['events'])
+    return stats
+
+  #médias por run das métricas de metrics(): clientes, utilização e espera
+  #runs sem nenhum serviço concluído não entram na espera, como em wait_metric
+  def run_samples(self):
+    area, last_time = np.array(self.area), np.array(self.last_time)
+    total_time, busy_time = np.array(self.total_time), np.array(self.busy_time)
+    wait_count, wait_mean = np.array(self.wait_count), np.array(self.wait_mean)
+    return {
+      'customers' : area / last_time,
+      'utilization' : busy_time / total_time,
+      'wait' : wait_mean[wait_count > 0]
+    }
+
+  #variância amostral dos tempos de permanência de cada run
+  def wait_variance(self):
+    wait_count, wait_m2 = np.array(self.wait_count), np.array(self.wait_m2)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+      return wait_m2 / (wait_count - 1)
+
+  #fração do tempo total em cada estado
+  def occupancy_pmf(self):
+    return self.occupancy[:self.max_state + 1] / self.occupancy.sum()
@@ -0,0 +1,51 @@
+import itertools
+import numpy as np
+
+#aceita None, inteiro ou SeedSequence
+def as_seed_sequence(seed):
+  if(isinstance(seed, np.random.SeedSequence)):
+    return seed
+  return np.random.SeedSequence(seed)
+
+#filho i de uma SeedSequence, derivado só da entropia e do spawn_key do pai
+#(ao contrário de SeedSequence.spawn, não depende de quantos filhos já foram gerados)
+def _child(seed, i):
+  return np.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key + (i,))
+
+#sementes das runs first_run, ..., first_run + runs - 1 derivadas da semente raiz
+#a semente de cada run depende só da raiz e do número da run, nunca de quantos workers são usados
+def run_seeds(seed, runs, first_run = 0):
+  root = as_seed_sequence(seed)
+  return [_child(root, i) for i in range(first_run, first_run + runs)]
+
+#geradores independentes para as chegadas e para os serviços de uma run
+def run_generators(seed):
+  seed = as_seed_sequence(seed)
+  return np.random.default_rng(_child(seed, 0)), np.random.default_rng(_child(seed, 1))
+
+#fluxo infinito de variáveis exponenciais geradas em blocos de block_size
+def _exponential_blocks(rng, scale, block_size):
+  while(True):
+    yield from rng.exponential(scale, size = block_size).tolist()
+
+#fonte de tempos entre chegadas e de serviço para o laço de eventos
+#sorteia em blocos com numpy.random.Generator e reabastece sob demanda, evitando uma chamada
+#ao numpy por evento; usa os mesmos fluxos de run_generators, então os valores são os mesmos
+#que os motores vetorizados sorteiam de uma vez para a mesma semente
+class VariateSource:
+  __slots__ = ('_interarrivals', '_services')
+
+  def __init__(self, lamda, mu, kind = 'm', seed = None, block_size = 4096):
+    assert kind in ['m','d']
+    arrival_rng, service_rng = run_generators(seed)
+    self._interarrivals = _exponential_blocks(arrival_rng, 1/lamda, block_size)
+    if(kind == 'm'):
+      self._services = _exponential_blocks(service_rng, 1/mu, block_size)
+    else:
+      self._services = itertools.repeat(1/mu)
+
+  def interarrival(self):
+    return next(self._interarrivals)
+
+  def service(self):
+    return next(self._services)